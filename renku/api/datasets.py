@@ -102,8 +102,10 @@ class DatasetsApiMixin(object):
                         self._add_from_git(dataset, dataset_path, url, t)
                     )
         else:
-            dataset.files.update(
-                self._add_from_url(dataset, dataset_path, url, **kwargs)
+            files = self._add_from_url(dataset, dataset_path, url, **kwargs)
+            dataset.files.update(files)
+            self.track_paths_in_storage(
+                *(dataset_path / path for path in files)
             )
 
     def _add_from_url(self, dataset, path, url, nocopy=False, **kwargs):
@@ -158,7 +160,6 @@ class DatasetsApiMixin(object):
         mode = dst.stat().st_mode & 0o777
         dst.chmod(mode & ~(stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH))
 
-        self.track_paths_in_storage(dst.relative_to(self.path))
         dataset_path = self.path / self.datadir / dataset.name
         result = dst.relative_to(dataset_path).as_posix()
         return {
@@ -18,21 +18,31 @@
 """Client for handling a local repository."""
 
 import datetime
-import uuid
+import os
+import re
+import tempfile
 from contextlib import contextmanager
+from functools import lru_cache
 from subprocess import PIPE, STDOUT, call
 
 import attr
 import filelock
-import pkg_resources
 import yaml
 from git import InvalidGitRepositoryError
 from git import Repo as GitRepo
 from werkzeug.utils import secure_filename
 
+from renku import errors
 from renku._compat import Path
 
-HAS_LFS = call(['git', 'lfs'], stdout=PIPE, stderr=STDOUT) == 0
+
+@lru_cache(maxsize=None)
+def has_lfs():
+    """Check once per process that Git LFS is installed."""
+    try:
+        return call(['git', 'lfs'], stdout=PIPE, stderr=STDOUT) == 0
+    except OSError:
+        return False
 
 
 @attr.s
@@ -57,6 +67,12 @@ class RepositoryApiMixin(object):
     WORKFLOW = 'workflow'
     """Directory for storing workflow in Renku."""
 
+    CACHE = 'cache'
+    """Directory for storing local caches in Renku."""
+
+    LFS_THRESHOLD = 'lfs-threshold'
+    """Option in the ``renku`` section of Git config with a size limit."""
+
     def __attrs_post_init__(self):
         """Initialize computed attributes."""
         #: Configure Renku path.
@@ -91,6 +107,26 @@ class RepositoryApiMixin(object):
         """Return a ``Path`` instance of the workflow folder."""
         return self.renku_path / self.WORKFLOW
 
+    @property
+    def cache_path(self):
+        """Return a ``Path`` instance of the cache folder.
+
+        The folder is ignored by Git and it is safe to remove it anytime
+        except for worktrees of running isolated commands.
+        """
+        path = self.renku_path / self.CACHE
+        gitignore = path / '.gitignore'
+        if not gitignore.exists():
+            #: Concurrent commands can create the folder at the same time,
+            #: hence the file is replaced atomically with the same content.
+            path.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=str(path), prefix='.')
+            with os.fdopen(fd, 'w') as fp:
+                # Ignore everything including this file.
+                fp.write('*\n')
+            os.replace(tmp_path, str(gitignore))
+        return path
+
     @contextmanager
     def with_metadata(self):
         """Yield an editable metadata object."""
@@ -114,6 +150,13 @@ class RepositoryApiMixin(object):
             with open(path, 'w') as f:
                 yaml.dump(source, f, default_flow_style=False)
 
+    def workflow_step_path(self, step):
+        """Return a path of the file storing the workflow step."""
+        return self.workflow_path / '{0}_{1}.cwl'.format(
+            secure_filename(str(step.id).replace('-', '')),
+            secure_filename('_'.join(step.run.baseCommand)),
+        )
+
     @contextmanager
     def with_workflow_storage(self):
         """Yield a workflow storage."""
@@ -125,16 +168,11 @@ class RepositoryApiMixin(object):
             yield workflow
 
             for step in workflow.steps:
-                step_name = '{0}_{1}.cwl'.format(
-                    uuid.uuid4().hex,
-                    secure_filename('_'.join(step.run.baseCommand)),
-                )
-
                 workflow_path = self.workflow_path
                 if not workflow_path.exists():
                     workflow_path.mkdir()
 
-                with open(workflow_path / step_name, 'w') as step_file:
+                with open(self.workflow_step_path(step), 'w') as step_file:
                     yaml.dump(
                         ascwl(
                             # filter=lambda _, x: not (x is False or bool(x)
@@ -164,6 +202,9 @@ class RepositoryApiMixin(object):
 
         self.git.description = name or path.name
 
+        #: Importing pkg_resources is slow, hence only commands need it.
+        import pkg_resources
+
         # TODO read existing gitignore and create a unique set of rules
         gitignore_default = pkg_resources.resource_stream(
             'renku.data', 'gitignore.default'
@@ -183,7 +224,7 @@ class RepositoryApiMixin(object):
             metadata.updated = datetime.datetime.utcnow()
 
         # initialize LFS if it is requested and installed
-        if use_external_storage and HAS_LFS:
+        if use_external_storage and has_lfs():
             self.init_external_storage(force=force)
 
         return str(path)
@@ -201,13 +242,87 @@ class RepositoryApiMixin(object):
             cwd=self.path.absolute(),
         )
 
+    @property
+    def has_external_storage(self):
+        """Check that the repository uses Git LFS and that it is installed.
+
+        Git LFS is looked up only for repositories configured to use it.
+        """
+        return self.git.config_reader(
+            config_level='repository'
+        ).has_section('filter "lfs"') and has_lfs()
+
+    @property
+    def lfs_threshold(self):
+        """Return the minimal size in bytes of files in external storage."""
+        value = self.git.config_reader().get_value(
+            'renku', self.LFS_THRESHOLD, 0
+        )
+        try:
+            return _parse_size(value)
+        except ValueError:
+            raise errors.ConfigurationError(
+                'renku.' + self.LFS_THRESHOLD, value
+            )
+
     def track_paths_in_storage(self, *paths):
-        """Track paths in the external storage."""
-        if HAS_LFS and self.git.config_reader(config_level='repository'
-                                              ).has_section('filter "lfs"'):
-            call(
-                ['git', 'lfs', 'track'] + list(paths),
-                stdout=PIPE,
-                stderr=STDOUT,
-                cwd=self.path,
+        """Track paths in the external storage.
+
+        Files smaller than :attr:`lfs_threshold` stay in Git.  Patterns of
+        new files are appended to ``.gitattributes`` with a single write.
+        """
+        if not paths or not self.has_external_storage:
+            return
+
+        attributes_path = self.path / '.gitattributes'
+        content = ''
+        if attributes_path.exists():
+            content = attributes_path.read_text()
+        existing = {
+            line.split()[0]
+            for line in content.splitlines() if line.strip()
+        }
+
+        threshold = self.lfs_threshold
+        lines = []
+        for path in paths:
+            path = os.path.join(str(self.path), str(path))
+            if os.path.islink(path) or not os.path.isfile(path) or \
+                    os.path.getsize(path) < threshold:
+                continue
+
+            pattern = _lfs_pattern(
+                Path(os.path.relpath(path, str(self.path))).as_posix()
             )
+            if pattern not in existing:
+                existing.add(pattern)
+                lines.append(
+                    '{0} filter=lfs diff=lfs merge=lfs -text\n'.
+                    format(pattern)
+                )
+
+        if lines:
+            if content and not content.endswith('\n'):
+                lines.insert(0, '\n')
+            with attributes_path.open('a') as fp:
+                fp.write(''.join(lines))
+
+
+def _lfs_pattern(path):
+    """Escape a path to a pattern matching only the path."""
+    pattern = re.sub(r'([\\*?\[\]])', r'\\\1', path)
+    if pattern.startswith(('#', '!')):
+        pattern = '\\' + pattern
+    return pattern.replace(' ', '[[:space:]]')
+
+
+#: Multipliers of size suffixes understood by ``git config --type=int``.
+_SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024**2, 'g': 1024**3}
+
+
+def _parse_size(value):
+    """Convert a size like ``10M`` to bytes or raise :class:`ValueError`."""
+    match = re.match(r'^\s*(\d+)\s*([kmg]?)\s*$', str(value), re.IGNORECASE)
+    if match is None:
+        raise ValueError(value)
+    return int(match.group(1)) * _SIZE_UNITS[match.group(2).lower()]
@@ -73,10 +73,9 @@ import uuid
 
 import click
 import yaml
-from click_plugins import with_plugins
-from pkg_resources import iter_entry_points
 
 from ._config import RENKU_HOME, default_config_dir, print_app_config_path
+from ._group import LazyGroup
 from ._version import print_version
 
 
@@ -87,9 +86,36 @@ def _uuid_representer(dumper, data):
 
 yaml.add_representer(uuid.UUID, _uuid_representer)
 
+#: Built-in commands with their help lines imported only when invoked.
+COMMANDS = {
+    # Please keep the items sorted.
+    'cache': ('renku.cli.cache:cache', 'Manage caches.'),
+    'dataset': ('renku.cli.dataset:dataset', 'Handle datasets.'),
+    'deactivate': (
+        'renku.cli.workon:deactivate',
+        'Deactivate environment for tracking work on a specific problem.'
+    ),
+    'init': ('renku.cli.init:init', 'Initialize a project.'),
+    'log': ('renku.cli.log:log', 'Show logs for a file.'),
+    'run': ('renku.cli.run:run', 'Tracking work on a specific problem.'),
+    'runner': ('renku.cli.runner:runner', 'Simplify running of CI scripts.'),
+    'status': ('renku.cli.status:status', 'Show a status of the repository.'),
+    'update': (
+        'renku.cli.update:update',
+        'Update existing files by rerunning their outdated workflow.'
+    ),
+    'workflow': ('renku.cli.workflow:workflow', 'Workflow operations.'),
+    'workon': (
+        'renku.cli.workon:workon',
+        'Activate environment for tracking work on a specific problem.'
+    ),
+}
+
 
-@with_plugins(iter_entry_points('renku.cli'))
 @click.group(
+    cls=LazyGroup,
+    lazy_commands=COMMANDS,
+    entry_point_group='renku.cli',
     context_settings={
         'auto_envvar_prefix': 'RENKU',
         'help_option_names': ['-h', '--help'],
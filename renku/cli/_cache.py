@@ -0,0 +1,536 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2018 - Swiss Data Science Center (SDSC)
+# A partnership between École Polytechnique Fédérale de Lausanne (EPFL) and
+# Eidgenössische Technische Hochschule Zürich (ETHZ).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Persistent caches stored in the Renku folder."""
+
+import hashlib
+import io
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import attr
+import yaml
+from git import Blob, Commit, GitCommandError
+
+from renku.models.cwl.command_line_tool import CommandLineTool
+from renku.models.cwl.workflow import Workflow
+from renku.version import __version__
+
+from ._git import _hash_objects
+
+
+class _Pickler(pickle.Pickler):
+    """Store Git commits and tools from the repository by reference."""
+
+    def __init__(self, stream, repo=None, **kwargs):
+        """Keep a reference to the repository."""
+        super(_Pickler, self).__init__(stream, **kwargs)
+        self.repo = repo
+
+    def persistent_id(self, obj):
+        """Replace a commit or a tool handle by its SHA."""
+        if isinstance(obj, Commit):
+            return 'commit', obj.binsha
+        if isinstance(obj, ToolHandle) and self.repo is not None and \
+                obj.repo.git_dir == self.repo.git_dir:
+            return 'tool', obj.binsha, obj.path
+
+
+class _Unpickler(pickle.Unpickler):
+    """Resolve Git commits and tools lazily from a repository."""
+
+    def __init__(self, stream, repo, cwl_cache=None):
+        """Keep a reference to the repository."""
+        super(_Unpickler, self).__init__(stream)
+        self.repo = repo
+        self.cwl_cache = cwl_cache or CWLCache()
+        self.commits = {}
+
+    def persistent_load(self, pid):
+        """Return a commit or a tool handle without reading its data."""
+        type_, binsha = pid[:2]
+        if type_ == 'tool':
+            return ToolHandle(self.repo, binsha, pid[2], self.cwl_cache)
+        if type_ != 'commit':  # pragma: no cover
+            raise pickle.UnpicklingError('Unsupported object.')
+        if binsha not in self.commits:
+            self.commits[binsha] = Commit(self.repo, binsha)
+        return self.commits[binsha]
+
+
+def dumps(obj, repo=None):
+    """Serialize an object possibly containing Git commits."""
+    stream = io.BytesIO()
+    _Pickler(stream, repo=repo, protocol=pickle.HIGHEST_PROTOCOL).dump(obj)
+    return stream.getvalue()
+
+
+def loads(data, repo, cwl_cache=None):
+    """Deserialize an object and bind Git commits to the repository."""
+    return _Unpickler(io.BytesIO(data), repo, cwl_cache=cwl_cache).load()
+
+
+def write_atomic(path, data):
+    """Replace content of the file without exposing partial writes."""
+    fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+        os.replace(tmp_path, str(path))
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+@attr.s
+class GraphCache(object):
+    """Store a snapshot of the provenance graph keyed by the HEAD commit.
+
+    A snapshot stays valid as long as the current HEAD is a descendant of the
+    commit it was created for.  New commits are added to the history index
+    and only used to update the ``latest`` attribute of file nodes.  When
+    history was rewritten the snapshot is discarded and the graph has to be
+    built from scratch.
+    """
+
+    client = attr.ib()
+
+    FILENAME = 'graph.pickle'
+    """Name of the snapshot file in the cache folder."""
+
+    @property
+    def path(self):
+        """Return a ``Path`` instance of the snapshot file."""
+        return self.client.cache_path / self.FILENAME
+
+    @property
+    def head(self):
+        """Return the current HEAD commit or ``None`` for empty repo."""
+        try:
+            return self.client.git.head.commit
+        except ValueError:
+            return None
+
+    def load(self, cwl_cache=None):
+        """Return a graph and a history index valid for the current HEAD."""
+        head = self.head
+        if head is None or not self.path.exists():
+            return
+
+        try:
+            with self.path.open('rb') as fp:
+                snapshot = loads(
+                    fp.read(), self.client.git, cwl_cache=cwl_cache
+                )
+            if snapshot['version'] != __version__:
+                return
+        except Exception:
+            return
+
+        graph = snapshot['graph']
+        history = snapshot['history']
+        if history.head != snapshot['head']:
+            #: The index was stored in an older format.
+            return
+        history.repo = self.client.git
+
+        if snapshot['head'] != head.hexsha:
+            if not self.client.git.is_ancestor(snapshot['head'], head.hexsha):
+                return
+
+            self.update_latest(graph, history, history.update())
+
+        return graph, history
+
+    def update_latest(self, graph, history, paths):
+        """Update ``latest`` for nodes with paths modified by new commits.
+
+        New commits can also revert the content to the one used by a node.
+        """
+        for (_, path), data in graph.nodes(data=True):
+            if path in paths:
+                try:
+                    data['latest'] = history.newer_commit(path, data['commit'])
+                except KeyError:
+                    #: Commits from submodules are not indexed.
+                    pass
+
+    def dump(self, graph, history):
+        """Store a snapshot of the graph for the current HEAD."""
+        head = self.head
+        if head is None:
+            return
+
+        snapshot = {
+            'version': __version__,
+            'head': head.hexsha,
+            'graph': graph,
+            'history': history,
+        }
+        write_atomic(self.path, dumps(snapshot, repo=self.client.git))
+
+
+def load_cwl(data):
+    """Deserialize a ``CommandLineTool`` or a ``Workflow``."""
+    cwl = yaml.load(data)
+    try:
+        return CommandLineTool.from_cwl(cwl)
+    except TypeError:
+        return Workflow.from_cwl(cwl)
+
+
+@attr.s
+class CWLCache(object):
+    """Cache deserialized CWL objects by the Git blob SHA.
+
+    Objects are kept in an in-memory LRU and optionally pickled to a
+    directory so each unique blob is parsed only once.  Returned objects are
+    shared and they must not be modified.
+    """
+
+    path = attr.ib(default=None)
+    """Directory with pickled objects or ``None`` to keep them in memory."""
+
+    maxsize = attr.ib(default=4096)
+    """Maximal number of objects kept in memory."""
+
+    STATS = 'stats.json'
+    """Name of the file with counters accumulated by previous commands."""
+
+    hits = attr.ib(init=False, default=0)
+    disk_hits = attr.ib(init=False, default=0)
+    misses = attr.ib(init=False, default=0)
+
+    _memory = attr.ib(init=False, default=attr.Factory(OrderedDict))
+    _saved = attr.ib(init=False, default=attr.Factory(dict))
+
+    def _blob_path(self, sha):
+        """Return a path of the pickled object."""
+        return self.path / sha[:2] / sha[2:]
+
+    def _load(self, sha):
+        """Load a pickled object from the disk."""
+        try:
+            with self._blob_path(sha).open('rb') as fp:
+                version, obj = pickle.load(fp)
+            if version == __version__:
+                return obj
+        except Exception:
+            pass
+
+    def _dump(self, sha, obj):
+        """Pickle an object to the disk."""
+        path = self._blob_path(sha)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(
+            path,
+            pickle.dumps((__version__, obj), protocol=pickle.HIGHEST_PROTOCOL)
+        )
+
+    def _remember(self, sha, obj):
+        """Store an object in memory and evict the least recently used."""
+        self._memory[sha] = obj
+        if len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def get(self, blob):
+        """Return a deserialized object from the blob."""
+        sha = blob.hexsha
+        if sha in self._memory:
+            self.hits += 1
+            self._memory.move_to_end(sha)
+            return self._memory[sha]
+
+        obj = self._load(sha) if self.path is not None else None
+        if obj is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            obj = load_cwl(blob.data_stream.read())
+            if self.path is not None:
+                self._dump(sha, obj)
+
+        self._remember(sha, obj)
+        return obj
+
+    def stats(self):
+        """Return hit and miss counters."""
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+        }
+
+    def counters(self):
+        """Return counters accumulated in the cache folder."""
+        counters = {'hits': 0, 'disk_hits': 0, 'misses': 0}
+        try:
+            with (self.path / self.STATS).open('r') as fp:
+                counters.update(json.load(fp))
+        except (OSError, ValueError):
+            pass
+        return counters
+
+    def save_counters(self):
+        """Add counters not saved yet to the cache folder."""
+        if self.path is None:
+            return
+
+        stats = self.stats()
+        counters = self.counters()
+        for name, value in stats.items():
+            counters[name] += value - self._saved.get(name, 0)
+        self.path.mkdir(parents=True, exist_ok=True)
+        write_atomic(
+            self.path / self.STATS,
+            json.dumps(counters).encode('utf-8')
+        )
+        self._saved = stats
+
+    def disk_stats(self):
+        """Return number of pickled objects, their size and counters."""
+        entries = list(self.path.glob('??/*')) if self.path.exists() else []
+        stats = self.counters()
+        stats['entries'] = len(entries)
+        stats['size'] = sum(path.stat().st_size for path in entries)
+        return stats
+
+
+@attr.s
+class RunCache(object):
+    """Map executions of tools to their outputs stored as Git objects.
+
+    Entries are keyed by a hash of the command line, standard streams and
+    blob SHAs of the input files.  Outputs are stored in the object database
+    with ``git hash-object`` and they are restored through Git filters, hence
+    files tracked in Git LFS are supported too.
+    """
+
+    client = attr.ib()
+
+    DIRNAME = 'runs'
+    """Name of the run cache folder in the cache folder."""
+
+    STATS = 'stats.json'
+    """Name of the file with hit and miss counters."""
+
+    VERSION = 1
+    """Version of the key format."""
+
+    _lock = attr.ib(init=False, default=attr.Factory(threading.Lock))
+
+    @property
+    def path(self):
+        """Return a ``Path`` instance of the run cache folder."""
+        path = self.client.cache_path / self.DIRNAME
+        if not path.exists():
+            path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def _entry_path(self, key):
+        """Return a path of the cache entry."""
+        return self.path / key[:2] / (key[2:] + '.json')
+
+    def _entries(self):
+        """Yield paths of all cache entries."""
+        for path in self.path.glob('??/*.json'):
+            yield path
+
+    def _count(self, name):
+        """Increment a counter in the stats file."""
+        with self._lock:
+            counters = self.counters()
+            counters[name] += 1
+            write_atomic(
+                self.path / self.STATS,
+                json.dumps(counters).encode('utf-8')
+            )
+
+    def counters(self):
+        """Return hit and miss counters."""
+        counters = {'hits': 0, 'misses': 0}
+        try:
+            with (self.path / self.STATS).open('r') as fp:
+                counters.update(json.load(fp))
+        except (OSError, ValueError):
+            pass
+        return counters
+
+    def key(self, step):
+        """Return a key of the step or ``None`` if it can not be cached."""
+        if step.outputs is None:
+            return
+
+        paths = list(step.inputs)
+        if step.stdin:
+            paths.append(step.stdin)
+
+        try:
+            shas = _hash_objects(self.client.git, paths)
+        except GitCommandError:
+            return
+
+        description = {
+            'version': self.VERSION,
+            'argv': step.argv,
+            'stdin': step.stdin,
+            'stdout': step.stdout,
+            'stderr': step.stderr,
+            'inputs': sorted(zip(paths, shas)),
+        }
+        return hashlib.sha256(
+            json.dumps(description, sort_keys=True).encode('utf-8')
+        ).hexdigest()
+
+    def restore(self, key):
+        """Restore recorded outputs and return their paths."""
+        if key is None:
+            return
+
+        path = self._entry_path(key)
+        try:
+            with path.open('r') as fp:
+                outputs = json.load(fp)['outputs']
+            for output, sha in outputs.items():
+                process = self.client.git.git.cat_file(
+                    '--filters',
+                    '--path={0}'.format(output),
+                    sha,
+                    as_process=True,
+                )
+                data = process.proc.stdout.read()
+                process.wait()
+                target = self.client.path / output
+                target.parent.mkdir(parents=True, exist_ok=True)
+                target.write_bytes(data)
+        except (OSError, ValueError, KeyError, GitCommandError):
+            self._count('misses')
+            return
+
+        #: The modification time is used for eviction.
+        os.utime(str(path))
+        self._count('hits')
+        return list(outputs)
+
+    def record(self, key, outputs):
+        """Store outputs of an execution in the cache."""
+        if key is None or not outputs:
+            return
+
+        try:
+            shas = _hash_objects(self.client.git, outputs, write=True)
+        except GitCommandError:
+            return
+
+        path = self._entry_path(key)
+        if not path.parent.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(
+            path,
+            json.dumps({
+                'outputs': dict(zip(outputs, shas))
+            }).encode('utf-8')
+        )
+
+    def stats(self):
+        """Return number of entries, their size and counters."""
+        entries = list(self._entries())
+        stats = self.counters()
+        stats['entries'] = len(entries)
+        stats['size'] = sum(path.stat().st_size for path in entries)
+        return stats
+
+    def evict(self, older_than=None, max_entries=None):
+        """Remove entries not used recently and return their number.
+
+        :param older_than: Remove entries not used for given seconds.
+        :param max_entries: Keep only given number of recently used entries.
+        """
+        entries = sorted(
+            self._entries(),
+            key=lambda path: path.stat().st_mtime,
+            reverse=True,
+        )
+        removed = []
+        if max_entries is not None:
+            removed.extend(entries[max_entries:])
+            entries = entries[:max_entries]
+        if older_than is not None:
+            limit = time.time() - older_than
+            removed.extend(
+                path for path in entries if path.stat().st_mtime < limit
+            )
+
+        for path in removed:
+            path.unlink()
+            try:
+                path.parent.rmdir()
+            except OSError:
+                pass
+        return len(removed)
+
+
+class ToolHandle(object):
+    """Reference a tool or a workflow stored in a Git blob.
+
+    The object is deserialized on every access through the CWL cache, hence
+    graph nodes do not keep parsed objects alive.
+    """
+
+    __slots__ = ('repo', 'binsha', 'path', 'cwl_cache')
+
+    def __init__(self, repo, binsha, path, cwl_cache=None):
+        """Store the blob reference."""
+        self.repo = repo
+        self.binsha = binsha
+        self.path = path
+        self.cwl_cache = cwl_cache
+
+    @property
+    def tool(self):
+        """Return the deserialized object."""
+        if self.cwl_cache is None:
+            self.cwl_cache = CWLCache()
+        return self.cwl_cache.get(Blob(self.repo, self.binsha, path=self.path))
+
+    def __eq__(self, other):
+        """Compare blob references."""
+        if not isinstance(other, ToolHandle):
+            return NotImplemented
+        return (self.binsha, self.path) == (other.binsha, other.path)
+
+    def __hash__(self):
+        """Hash the blob reference."""
+        return hash((self.binsha, self.path))
+
+    def __repr__(self):
+        """Format the blob reference."""
+        return '<ToolHandle {0}>'.format(self.path)
+
+    def __reduce__(self):
+        """Store the deserialized object if not referenced by SHA."""
+        return _identity, (self.tool, )
+
+
+def _identity(obj):
+    """Return the argument."""
+    return obj
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2018 - Swiss Data Science Center (SDSC)
+# A partnership between École Polytechnique Fédérale de Lausanne (EPFL) and
+# Eidgenössische Technische Hochschule Zürich (ETHZ).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Execute command line tools from the provenance graph."""
+
+import glob
+import os
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+
+import attr
+from git import GitCommandError
+
+from renku import errors
+from renku.models.cwl.types import File
+
+from ._git import _hash_objects
+from ._usage import wait
+
+_RE_INPUT_PATH = re.compile(r'^\$\(inputs\.(?P<id>[^.)]+)\.path\)$')
+_RE_INPUT = re.compile(r'^\$\(inputs\.(?P<id>[^.)]+)\)$')
+
+
+@attr.s
+class Step(object):
+    """Represent a tool with paths relative to the repository."""
+
+    key = attr.ib()
+    tool = attr.ib()
+    argv = attr.ib()
+    stdin = attr.ib(default=None)
+    stdout = attr.ib(default=None)
+    stderr = attr.ib(default=None)
+
+    inputs = attr.ib(default=attr.Factory(list))
+    """Paths of input files."""
+
+    outputs = attr.ib(default=None)
+    """Paths of output files or ``None`` if they can not be determined."""
+
+    cached = attr.ib(default=False)
+    """Indicate that outputs were restored from the run cache."""
+
+    usage = attr.ib(default=None)
+    """Resources used by the execution (see :class:`Usage`)."""
+
+    @classmethod
+    def from_node(cls, key, tool, basedir=None):
+        """Resolve file inputs relative to the directory of the tool."""
+        if basedir is None:
+            basedir = os.path.dirname(key[1])
+        inputs = []
+        defaults = {}
+        paths = []
+
+        for input_ in tool.inputs:
+            if isinstance(input_.default, File):
+                path = os.path.normpath(
+                    os.path.join(basedir, str(input_.default.path))
+                )
+                paths.append(path)
+                input_ = attr.evolve(input_, default=File(path=path))
+            defaults[input_.id] = input_.default
+            inputs.append(input_)
+
+        stdin = tool.stdin
+        if stdin:
+            match = _RE_INPUT_PATH.match(stdin)
+            stdin = str(defaults[match.group('id')]) if match else stdin
+
+        return cls(
+            key=key,
+            tool=tool,
+            argv=attr.evolve(tool, inputs=inputs).to_argv(),
+            stdin=stdin,
+            stdout=tool.stdout,
+            stderr=tool.stderr,
+            inputs=paths,
+            outputs=_output_paths(tool, defaults),
+        )
+
+
+def _output_paths(tool, defaults):
+    """Return paths of tool outputs or ``None`` for unknown paths."""
+    paths = []
+    for output in tool.outputs:
+        if output.type in {'stdout', 'stderr'}:
+            paths.append(getattr(tool, output.type))
+            continue
+
+        pattern = output.outputBinding.glob
+        match = _RE_INPUT.match(pattern)
+        if match:
+            paths.append(str(defaults[match.group('id')]))
+        elif not glob.has_magic(pattern):
+            paths.append(pattern)
+        else:
+            return
+    return paths
+
+
+@attr.s
+class EarlyCutoff(object):
+    """Skip steps whose inputs were not modified by previous steps.
+
+    Files with newer versions are modified initially.  Outputs of executed
+    steps are compared with their versions in the current HEAD and only
+    outputs with a different content hash trigger the following steps.
+    """
+
+    client = attr.ib()
+    G = attr.ib()
+
+    changed = attr.ib(default=attr.Factory(set))
+    """Paths of modified files."""
+
+    skipped = attr.ib(default=attr.Factory(list))
+    """Keys of skipped tools."""
+
+    def __attrs_post_init__(self):
+        """Collect files with newer versions."""
+        self.changed |= {
+            path
+            for (_, path), data in self.G.nodes(data=True)
+            if data.get('latest')
+        }
+
+    def filter(self, waves):
+        """Yield tool keys with at least one modified input."""
+        for wave in waves:
+            keys = []
+            for key in wave:
+                if any(
+                    path in self.changed
+                    for _, path in self.G.predecessors(key)
+                ):
+                    keys.append(key)
+                else:
+                    self.skipped.append(key)
+            yield keys
+
+    def completed(self, key):
+        """Mark outputs of the tool with a new content as modified."""
+        paths = [path for _, path in self.G.successors(key)]
+        try:
+            shas = _hash_objects(self.client.git, paths)
+        except GitCommandError:
+            self.changed.update(paths)
+            return
+
+        tree = self.client.git.head.commit.tree
+        for path, sha in zip(paths, shas):
+            try:
+                previous = (tree / path).hexsha
+            except KeyError:
+                previous = None
+            if sha != previous:
+                self.changed.add(path)
+
+
+@attr.s
+class LocalExecutor(object):
+    """Run steps in waves with a bounded number of processes."""
+
+    directory = attr.ib(default='.', converter=str)
+    jobs = attr.ib(default=1)
+
+    run_cache = attr.ib(default=None)
+    """Restore outputs of steps from a :class:`RunCache`."""
+
+    usage_log = attr.ib(default=None)
+    """Record resources used by executed steps in a :class:`UsageLog`."""
+
+    _lock = attr.ib(init=False, default=attr.Factory(threading.Lock))
+    _processes = attr.ib(init=False, default=attr.Factory(set))
+    _failed = attr.ib(init=False, default=False)
+
+    def _path(self, path):
+        """Return the path relative to the working directory."""
+        return os.path.join(self.directory, str(path))
+
+    def execute(self, step):
+        """Run a step and return its exit code."""
+        with ExitStack() as stack:
+            streams = {}
+            if step.stdin:
+                streams['stdin'] = stack.enter_context(
+                    open(self._path(step.stdin), 'rb')
+                )
+            for name in ('stdout', 'stderr'):
+                path = getattr(step, name)
+                if path:
+                    streams[name] = stack.enter_context(
+                        open(self._path(path), 'wb')
+                    )
+
+            with self._lock:
+                if self._failed:
+                    return
+                start = time.monotonic()
+                process = subprocess.Popen(
+                    step.argv, cwd=self.directory, **streams
+                )
+                self._processes.add(process)
+
+            try:
+                step.usage = wait(process, start)
+                return step.usage.exit_code
+            finally:
+                with self._lock:
+                    self._processes.discard(process)
+
+    def execute_cached(self, step):
+        """Restore outputs from the run cache or run the step."""
+        key = self.run_cache.key(step) if self.run_cache else None
+        if key is not None and self.run_cache.restore(key) is not None:
+            step.cached = True
+            return 0
+
+        returncode = self.execute(step)
+        if returncode in (step.tool.successCodes or [0]):
+            if key is not None:
+                self.run_cache.record(key, step.outputs)
+            if self.usage_log is not None:
+                self.usage_log.record(step.key[1], step.usage)
+        return returncode
+
+    def terminate(self):
+        """Stop all running steps."""
+        with self._lock:
+            self._failed = True
+            for process in self._processes:
+                try:
+                    process.terminate()
+                except ProcessLookupError:
+                    #: The process was already reaped by ``os.wait4``.
+                    pass
+
+    def run(self, waves):
+        """Execute waves of steps and yield them as they finish.
+
+        The first failing step stops all running steps and raises
+        :class:`renku.errors.FailedExecution`.
+        """
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for wave in waves:
+                futures = {
+                    executor.submit(self.execute_cached, step): step
+                    for step in wave
+                }
+                for future in as_completed(futures):
+                    step = futures[future]
+                    returncode = future.result()
+                    if returncode not in (step.tool.successCodes or [0]):
+                        for pending in futures:
+                            pending.cancel()
+                        self.terminate()
+                        raise errors.FailedExecution(step, returncode)
+                    yield step
@@ -18,16 +18,26 @@
 """Utility functions for managing the underling Git repository."""
 
 import os
+import subprocess
 import sys
+import tempfile
 from contextlib import contextmanager
+from stat import S_ISREG
 
 import click
+import filelock
 from git import Repo
 
 from renku import errors
 
 GIT_KEY = 'renku.git'
 
+STAGE_KEY = 'renku.git.stage'
+
+_COMMIT_PATHS = {}
+
+_STAT_MAPS = {}
+
 
 def set_git_home(value):
     """Set Git path."""
@@ -43,6 +53,57 @@ def get_git_home():
     return '.'
 
 
+def stage_paths(*paths):
+    """Register paths modified by the current command.
+
+    When a command registers its paths, :func:`with_git` stages only them
+    instead of scanning the whole working tree.
+    """
+    ctx = click.get_current_context()
+    ctx.meta.setdefault(STAGE_KEY, set()).update(
+        os.path.abspath(str(path)) for path in paths
+    )
+
+
+def _pathspec_command(command, paths, *args):
+    """Run a Git command with literal paths read from stdin.
+
+    Paths are not passed as arguments to stay below the argument size limit.
+    """
+    process = command(
+        *args,
+        '--pathspec-from-file=-',
+        '--pathspec-file-nul',
+        as_process=True,
+        istream=subprocess.PIPE,
+        env={'GIT_LITERAL_PATHSPECS': '1'},
+    )
+    _, stderr = process.proc.communicate('\0'.join(paths).encode('utf-8'))
+    process.wait(stderr=stderr)
+
+
+def _stage(repo):
+    """Stage registered paths or all changes in the working tree.
+
+    Return ``False`` if registered paths did not change anything.
+    """
+    ctx = click.get_current_context(silent=True)
+    paths = ctx.meta.get(STAGE_KEY) if ctx else None
+    if not paths:
+        repo.git.add('--all')
+        return True
+
+    existing = sorted(path for path in paths if os.path.lexists(path))
+    removed = sorted(set(paths) - set(existing))
+    if existing:
+        _pathspec_command(repo.git.add, existing, '--all')
+    if removed:
+        _pathspec_command(
+            repo.git.rm, removed, '--cached', '--ignore-unmatch', '-r', '-q'
+        )
+    return repo.is_dirty(index=True, working_tree=False)
+
+
 def _dirty_paths(repo):
     """Get paths of dirty files in the repository."""
     return repo.untracked_files + [
@@ -50,27 +111,140 @@ def _dirty_paths(repo):
     ]
 
 
-def _mapped_std_streams(lookup_paths):
-    """Get a mapping of standard streams to given paths."""
-    # FIXME add device number too
-    standard_inos = {}
-    for stream in ('stdin', 'stdout', 'stderr'):
+def _commit_paths(commit, prefix=None):
+    """Return paths modified by the commit.
+
+    Only paths under the given prefix are compared and the result is
+    memoized for the lifetime of the process.
+    """
+    key = commit.repo.git_dir, commit.hexsha, prefix
+    if key not in _COMMIT_PATHS:
+        args = ['-r', '--name-only', '--no-commit-id', '--no-renames', '-z']
+        if commit.parents:
+            args += [commit.parents[0].hexsha, commit.hexsha]
+        else:
+            args += ['--root', commit.hexsha]
+        if prefix:
+            args += ['--', prefix]
+
+        output = commit.repo.git.diff_tree(*args)
+        _COMMIT_PATHS[key] = frozenset(
+            path for path in output.split('\0') if path
+        )
+    return _COMMIT_PATHS[key]
+
+
+def _hash_objects(repo, paths, write=False):
+    """Return blob SHAs of files after applying Git filters."""
+    if not paths:
+        return []
+    args = ['-w'] if write else []
+    return repo.git.hash_object(*args, '--', *paths).split()
+
+
+def _changed_paths(repo, since, revision='HEAD'):
+    """Return paths modified by commits in the ``since..revision`` range."""
+    output = repo.git.log(
+        '--name-only',
+        '--format=',
+        '--no-renames',
+        '-z',
+        '{0}..{1}'.format(since, revision),
+    )
+    return {path.strip('\n') for path in output.split('\0')} - {''}
+
+
+def _index_stat_map(repo):
+    """Return a mapping of device and inode to paths from the index.
+
+    Git stores both numbers truncated to 32 bits.  The mapping is cached
+    until the index file changes.
+    """
+    index_path = os.path.join(repo.git_dir, 'index')
+    try:
+        stat = os.stat(index_path)
+    except OSError:
+        return {}
+
+    key = index_path, stat.st_mtime_ns, stat.st_size
+    if key not in _STAT_MAPS:
+        _STAT_MAPS.clear()
+        _STAT_MAPS[key] = {(entry.dev, entry.inode): entry.path
+                           for entry in repo.index.entries.values()}
+    return _STAT_MAPS[key]
+
+
+def _stat_key(stat):
+    """Return device and inode as stored in the index."""
+    return stat.st_dev & 0xffffffff, stat.st_ino & 0xffffffff
+
+
+def _fd_path(fd):
+    """Return an absolute path of the open file or ``None`` if unknown."""
+    try:
+        return os.readlink('/proc/self/fd/{0}'.format(fd))
+    except OSError:
+        return
+
+
+def _mapped_std_streams(repo):
+    """Get a mapping of standard streams to paths in the repository.
+
+    Only streams redirected to regular files are looked up.  Tracked files
+    are found through the stat data in the index, other files through the
+    file descriptor.  Untracked files are scanned as the last resort only
+    if the descriptor path is unknown or it is in the working tree.
+    """
+    streams = {}
+    for name in ('stdin', 'stdout', 'stderr'):
         try:
-            stream_stat = os.fstat(getattr(sys, stream).fileno())
-            key = stream_stat.st_dev, stream_stat.st_ino
-            standard_inos[key] = stream
+            fd = getattr(sys, name).fileno()
+            stat = os.fstat(fd)
         except Exception:  # FIXME UnsupportedOperation
-            pass
-        # FIXME if not getattr(sys, stream).istty()
+            continue
+        if S_ISREG(stat.st_mode):
+            streams[name] = fd, stat
 
-    lookup_inos = {(stat.st_dev, stat.st_ino): path
-                   for stat, path in ((os.stat(path), path)
-                                      for path in lookup_paths)}
+    if not streams:
+        return {}
 
-    return {
-        standard_inos[key]: lookup_inos[key]
-        for key in set(standard_inos.keys()) & set(lookup_inos.keys())
-    }
+    root = repo.working_tree_dir
+    real_root = os.path.realpath(root)
+    index_map = _index_stat_map(repo)
+    untracked = None
+    mapped = {}
+
+    def same_file(stat, path):
+        """Check that the path points to the file."""
+        try:
+            return os.path.samestat(stat, os.stat(os.path.join(root, path)))
+        except OSError:
+            return False
+
+    for name, (fd, stat) in streams.items():
+        path = index_map.get(_stat_key(stat))
+        if path and same_file(stat, path):
+            mapped[name] = path
+            continue
+
+        path = _fd_path(fd)
+        if path is not None:
+            path = os.path.relpath(path, real_root)
+            if path.startswith(os.pardir):
+                #: The file is outside of the repository.
+                continue
+            if same_file(stat, path):
+                mapped[name] = path
+                continue
+
+        if untracked is None:
+            untracked = repo.untracked_files
+        for path in untracked:
+            if same_file(stat, path):
+                mapped[name] = path
+                break
+
+    return mapped
 
 
 @contextmanager
@@ -88,7 +262,7 @@ def with_git(
 
             if ignore_std_streams:
                 dirty_paths = set(_dirty_paths(repo))
-                mapped_paths = set(_mapped_std_streams(dirty_paths).values())
+                mapped_paths = set(_mapped_std_streams(repo).values())
 
                 if dirty_paths - mapped_paths:
                     raise errors.DirtyRepository(repo)
@@ -110,12 +284,31 @@ def with_git(
         try:
             os.chdir(repo_path)
             repo = Repo(get_git_home())
-            repo.git.add('--all')
-            repo.index.commit(' '.join(sys.argv))
+            if _stage(repo):
+                repo.index.commit(' '.join(sys.argv))
         finally:
             os.chdir(current_dir)
 
 
+@contextmanager
+def with_worktree(repo, path, revision='HEAD'):
+    """Yield a repository checked out in a new temporary worktree.
+
+    Git does not support adding and removing worktrees concurrently, hence
+    these operations are serialized by a lock file in the folder.
+    """
+    path.mkdir(parents=True, exist_ok=True)
+    lock = filelock.FileLock(str(path / '.lock'))
+    worktree_path = tempfile.mkdtemp(dir=str(path))
+    with lock:
+        repo.git.worktree('add', '--detach', worktree_path, revision)
+    try:
+        yield Repo(worktree_path)
+    finally:
+        with lock:
+            repo.git.worktree('remove', '--force', worktree_path)
+
+
 def _safe_issue_checkout(repo, issue=None):
     """Safely checkout branch for the issue."""
     branch_name = str(issue) if issue else 'master'
@@ -18,57 +18,295 @@
 """Graph builder."""
 
 import os
+import sys
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from itertools import groupby
 from operator import itemgetter
 
 import attr
 import networkx as nx
-import yaml
 from git import IndexFile, Submodule
 
 from renku._compat import Path
 from renku.api import LocalClient
-from renku.models.cwl.command_line_tool import CommandLineTool
 from renku.models.cwl.parameter import InputParameter, WorkflowOutputParameter
 from renku.models.cwl.types import File
 from renku.models.cwl.workflow import Workflow
 
+from ._cache import CWLCache, GraphCache, ToolHandle, dumps, loads
+from ._executor import _output_paths
+from ._git import _commit_paths
+from ._history import HistoryIndex, blob_sha
+
+
+class NodeData(MutableMapping):
+    """Store attributes of a graph node in slots.
+
+    Known attributes do not need a dictionary per node, the other ones are
+    kept in a dictionary created on first use.  Tools and workflows can be
+    stored as :class:`ToolHandle` and they are deserialized on access.
+    """
+
+    __slots__ = (
+        'commit',
+        'path',
+        'latest',
+        'tool',
+        'expanded',
+        'submodule',
+        'contraction',
+        'workflow',
+        'workflow_path',
+        '_extra',
+    )
+
+    _FIELDS = __slots__[:-1]
+
+    def __init__(self, *args, **kwargs):
+        """Initialize attributes like a dictionary."""
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        """Return a value of the attribute."""
+        try:
+            if key in self._FIELDS:
+                value = getattr(self, key)
+                if isinstance(value, ToolHandle):
+                    return value.tool
+                return value
+            return self._extra[key]
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        """Set a value of the attribute."""
+        if key in self._FIELDS:
+            setattr(self, key, value)
+        else:
+            try:
+                self._extra[key] = value
+            except AttributeError:
+                self._extra = {key: value}
+
+    def __delitem__(self, key):
+        """Remove the attribute."""
+        try:
+            if key in self._FIELDS:
+                delattr(self, key)
+            else:
+                del self._extra[key]
+        except AttributeError:
+            raise KeyError(key)
+
+    def __iter__(self):
+        """Iterate over names of set attributes."""
+        for name in self._FIELDS:
+            if hasattr(self, name):
+                yield name
+        yield from getattr(self, '_extra', ())
+
+    def __contains__(self, key):
+        """Check if the attribute is set without deserializing tools."""
+        if key in self._FIELDS:
+            return hasattr(self, key)
+        return key in getattr(self, '_extra', ())
+
+    def __len__(self):
+        """Return number of set attributes."""
+        return sum(1 for _ in self)
+
+    def __eq__(self, other):
+        """Compare attributes without deserializing tools."""
+        if isinstance(other, NodeData):
+            return self.__getstate__() == other.__getstate__()
+        return super(NodeData, self).__eq__(other)
+
+    def __repr__(self):
+        """Format attributes as a dictionary."""
+        return repr(self.__getstate__())
+
+    def __getstate__(self):
+        """Return attributes as a dictionary."""
+        state = {
+            name: getattr(self, name)
+            for name in self._FIELDS if hasattr(self, name)
+        }
+        state.update(getattr(self, '_extra', {}))
+        return state
+
+    def __setstate__(self, state):
+        """Restore attributes from a dictionary."""
+        self.update(state)
+
+    def update(self, *args, **kwargs):
+        """Update attributes without deserializing tools."""
+        if len(args) == 1 and isinstance(args[0], NodeData):
+            args = (args[0].__getstate__(), )
+        super(NodeData, self).update(*args, **kwargs)
+
+    def copy(self):
+        """Return a shallow copy."""
+        return NodeData(self)
+
+
+def _tool_outputs(tool):
+    """Return paths of tool outputs with known names."""
+    defaults = {input_.id: input_.default for input_ in tool.inputs}
+    return _output_paths(tool, defaults) or ()
+
+
+class ProvenanceGraph(nx.DiGraph):
+    """Directed graph storing node attributes in :class:`NodeData`."""
+
+    node_attr_dict_factory = NodeData
+
+
+def _build_subgraph(
+    path, cwl_cache_path, history, workflow_index, revision, filepaths
+):
+    """Build a serialized graph of files in a worker process."""
+    client = LocalClient(path=path)
+    graph = Graph(client, cwl_cache=CWLCache(path=cwl_cache_path))
+    graph._history = loads(history, client.git)
+    graph._history.repo = client.git
+    graph._history_updated = True
+    graph.G.graph['workflow_index'] = workflow_index
+    graph._revision = revision
+
+    for filepath in filepaths:
+        graph.add_file(filepath, revision=revision)
+    return dumps(graph.G, repo=client.git)
+
+
+@attr.s
+class ExecutionPlan(object):
+    """Represent nodes needed to regenerate a set of outputs."""
+
+    nodes = attr.ib(default=attr.Factory(set))
+    """Keys of nodes in the selected subgraph."""
+
+    waves = attr.ib(default=attr.Factory(list))
+    """Lists of tool keys which can be executed concurrently."""
+
+    @property
+    def tools(self):
+        """Return tool keys in execution order."""
+        return [key for wave in self.waves for key in wave]
+
 
 @attr.s
 class Graph(object):
     """Represent the provenance graph."""
 
     client = attr.ib()
-    G = attr.ib(default=attr.Factory(nx.DiGraph))
+    G = attr.ib(default=attr.Factory(ProvenanceGraph))
+
+    use_cache = attr.ib(default=False)
+    """Load and store graph snapshots in the Renku cache folder."""
+
+    cwl_cache = attr.ib(default=None)
+    """Cache of deserialized CWL objects (see :class:`CWLCache`)."""
 
     cwl_prefix = attr.ib(init=False)
 
+    _history = attr.ib(init=False)
+    _history_updated = attr.ib(init=False, default=False)
+
+    _revision = attr.ib(init=False, default='HEAD')
+    """Revision with the versions of files compared in ``latest``."""
+
+    _commits = attr.ib(init=False, default=attr.Factory(dict))
+
+    _submodule_items = attr.ib(init=False, default=attr.Factory(dict))
+    _submodule_clients = attr.ib(init=False, default=attr.Factory(dict))
+    _submodule_graphs = attr.ib(init=False, default=attr.Factory(dict))
+
+    _sources = attr.ib(init=False, default=attr.Factory(list))
+    _outdated = attr.ib(init=False, default=attr.Factory(dict))
+
     def __attrs_post_init__(self):
         """Derive basic informations."""
         self.cwl_prefix = str(
             self.client.workflow_path.resolve().relative_to(self.client.path)
         )
+        self._history = HistoryIndex(self.client.git)
+
+        if self.cwl_cache is None:
+            path = self.client.cache_path / 'cwl' if self.use_cache else None
+            self.cwl_cache = CWLCache(path=path)
+
+        if self.use_cache:
+            cached = GraphCache(self.client).load(cwl_cache=self.cwl_cache)
+            if cached is not None:
+                self.G, self._history = cached
+                self._history_updated = True
+
+        self.G.graph.setdefault('workflows', {})
+
+    @property
+    def history(self):
+        """Return an index of paths modified in the current history."""
+        if not self._history_updated:
+            self._history.update()
+            self._history_updated = True
+        return self._history
+
+    def save_cache(self):
+        """Store the graph snapshot for the current HEAD."""
+        if self.use_cache and self._revision == 'HEAD':
+            GraphCache(self.client).dump(self.G, self.history)
+            self.cwl_cache.save_counters()
+
+    def _commit(self, commit):
+        """Return a shared instance of the commit."""
+        if commit is None:
+            return
+        return self._commits.setdefault(commit.hexsha, commit)
 
     def add_node(self, commit, path, **kwargs):
         """Add a node representing a file."""
         key = str(commit), str(path)
         if key not in self.G.node:
-            latest = self.find_latest(commit, path)
+            commit = self._commit(commit)
+            key = sys.intern(key[0]), sys.intern(key[1])
+            latest = self._commit(
+                self.find_latest(commit, path, revision=self._revision)
+            )
             self.G.add_node(
-                key, commit=commit, path=path, latest=latest, **kwargs
+                key, commit=commit, path=key[1], latest=latest, **kwargs
             )
         return key
 
-    def find_cwl(self, commit):
-        """Return a CWL."""
-        files = [
-            file_ for file_ in commit.stats.files.keys()
-            if file_.startswith(self.cwl_prefix) and file_.endswith('.cwl')
-        ]
+    def load_cwl(self, commit, path):
+        """Return a deserialized tool or workflow from the commit."""
+        return self.cwl_cache.get(commit.tree / path)
+
+    def cwl_handle(self, commit, path):
+        """Return a lazy reference to a tool or workflow from the commit."""
+        blob = commit.tree / path
+        return ToolHandle(self.client.git, blob.binsha, path, self.cwl_cache)
+
+    def find_cwl(self, commit, path=None):
+        """Return a CWL of the commit generating the path.
+
+        A commit recording several commands contains one tool per command,
+        hence the tool with an output matching the path is selected.
+        """
+        files = sorted(
+            file_ for file_ in _commit_paths(commit, prefix=self.cwl_prefix)
+            if file_.endswith('.cwl')
+        )
 
         if len(files) == 1:
             return files[0]
 
+        if path is not None:
+            for file_ in files:
+                if self.load_cwl(commit, file_).get_output_id(path):
+                    return file_
+
     def find_latest_cwl(self):
         """Return the latest CWL in the repository."""
         for commit in self.client.git.iter_commits(paths=self.cwl_prefix):
@@ -76,13 +314,132 @@ class Graph(object):
             if cwl:
                 return cwl
 
-    def find_latest(self, start, path):
-        """Return the latest commit for path."""
-        commits = list(
-            self.client.git.iter_commits('{0}..'.format(start), paths=path)
-        )
-        if commits:
-            return commits[-1]
+    def find_commit(self, path, revision='HEAD'):
+        """Return the last commit modifying the path in the revision."""
+        try:
+            return self.history.last_commit(path, revision=revision)
+        except KeyError:
+            #: The revision is not reachable from HEAD.
+            for commit in self.client.git.iter_commits(revision, paths=path):
+                return commit
+
+    def find_settled(self, commit, path, revision='HEAD'):
+        """Return a later workflow commit regenerating the unchanged path.
+
+        Steps skipped by ``renku update`` or producing identical outputs are
+        recorded in its workflow, but their outputs are not committed again.
+        """
+        commits = self.settled_outputs().get(path)
+        if not commits:
+            return
+
+        history = self.history
+        start = history.position(commit)
+        position = history.position(revision)
+        if start is None or position is None:
+            return
+
+        for sha in reversed(commits):
+            candidate = history.positions[sha]
+            if candidate <= start:
+                break
+            if history.is_ancestor(candidate, position) and \
+                    history.is_ancestor(start, candidate):
+                candidate = history.commit(candidate)
+                if blob_sha(candidate, path) == blob_sha(commit, path):
+                    return candidate
+
+    def workflow_index(self):
+        """Return paths used and generated by recorded tools.
+
+        ``settled`` maps paths generated by workflows to SHAs of their
+        commits and ``consumers`` maps input paths to outputs of tools using
+        them.  Only commits indexed since the last call are loaded and the
+        index is stored in the graph snapshot.
+        """
+        history = self.history
+        count = len(history.commits)
+        index = self.G.graph.get('workflow_index')
+        if index is None or index['count'] > count or (
+            index['count'] and
+            history.commits[index['count'] - 1] != index['last']
+        ):
+            index = {'count': 0, 'last': None, 'settled': {}, 'consumers': {}}
+
+        if index['count'] < count:
+            paths = history.prefix_paths(self.cwl_prefix, index['count'])
+            for position in sorted(paths):
+                commit = history.commit(position)
+                files = [
+                    path for path in paths[position] if path.endswith('.cwl')
+                ]
+                for path in files:
+                    try:
+                        tool = self.load_cwl(commit, path)
+                    except KeyError:
+                        #: The file was removed.
+                        continue
+
+                    if not isinstance(tool, Workflow):
+                        outputs = _tool_outputs(tool)
+                        for input_path, _ in self.iter_file_inputs(
+                            tool, os.path.dirname(path)
+                        ):
+                            consumers = index['consumers'].setdefault(
+                                input_path, set()
+                            )
+                            consumers.update(outputs)
+                    elif len(files) == 1:
+                        for output in self._workflow_outputs(
+                            commit, path, tool
+                        ):
+                            index['settled'].setdefault(output, []).append(
+                                commit.hexsha
+                            )
+            index.update(count=count, last=history.commits[-1])
+
+        self.G.graph['workflow_index'] = index
+        return index
+
+    def settled_outputs(self):
+        """Map paths generated by workflows to SHAs of their commits."""
+        return self.workflow_index()['settled']
+
+    def downstream_paths(self, paths):
+        """Return paths generated directly or indirectly from the paths."""
+        consumers = self.workflow_index()['consumers']
+        result = set()
+        stack = list(paths)
+        while stack:
+            for output in consumers.get(stack.pop(), ()):
+                if output not in result:
+                    result.add(output)
+                    stack.append(output)
+        return result
+
+    def _workflow_outputs(self, commit, path, workflow):
+        """Return paths generated by steps of the workflow."""
+        basedir = os.path.dirname(path)
+        outputs = set()
+        for step in workflow.steps:
+            tool = self.load_cwl(commit, os.path.join(basedir, step.run))
+            if not isinstance(tool, Workflow):
+                outputs.update(_tool_outputs(tool))
+        return outputs
+
+    def find_latest(self, start, path, revision='HEAD'):
+        """Return the latest commit for path if its content changed."""
+        try:
+            return self.history.newer_commit(path, start, revision=revision)
+        except KeyError:
+            commits = list(
+                self.client.git.iter_commits(
+                    '{0}..{1}'.format(start, revision), paths=path
+                )
+            )
+            target = self.client.git.commit(revision)
+            if commits and blob_sha(start, path) != blob_sha(target, path):
+                return commits[0]
 
     def iter_file_inputs(self, tool, basedir):
         """Yield path of tool file inputs."""
@@ -95,13 +452,25 @@ class Graph(object):
                     os.path.normpath(basedir / input_.default.path), input_.id
                 )
 
-    def add_workflow(self, commit, path, cwl=None, file_key=None):
+    def add_workflow(self, commit, path, workflow=None, file_key=None):
         """Add a workflow and its dependencies to the graph."""
-        if cwl is None:
-            data = (commit.tree / path).data_stream.read()
-            cwl = yaml.load(data)
+        workflow_key = str(commit), str(path)
+        steps = self.G.graph['workflows'].get(workflow_key)
+        if steps is not None:
+            #: Steps are already in the graph, only connect the output.
+            if file_key:
+                _, output_path = file_key
+                for tool_key in steps:
+                    step_tool = self.G.nodes[tool_key]['tool']
+                    output_id = step_tool.get_output_id(output_path)
+                    if output_id:
+                        self.G.add_edge(tool_key, file_key, id=output_id)
+            return self.G.nodes[steps[0]]['workflow'] if steps else None
+
+        handle = self.cwl_handle(commit, path)
+        if workflow is None:
+            workflow = handle.tool
 
-        workflow = Workflow.from_cwl(cwl)
         basedir = os.path.dirname(path)
 
         # Keep track of node identifiers for steps, inputs and outputs:
@@ -129,14 +498,14 @@ class Graph(object):
             for input_path, input_id in self.iter_file_inputs(
                 step_tool, basedir
             ):
-                if input_path in commit.stats.files:
-                    #: Check intermediate committed files
+                source = step.in_.get(input_id, '')
+                if input_path in _commit_paths(commit) or '/' in source:
+                    #: Check intermediate committed or unchanged files
                     input_key = self.add_node(commit, input_path)
                     #: Edge from an input to the tool.
                     self.G.add_edge(input_key, tool_key, id=input_id)
                 else:
                     #: Global workflow input
-                    source = step.in_[input_id]
                     self.G.add_edge(input_map[source], tool_key, id=input_id)
 
             if file_key:
@@ -151,7 +520,7 @@ class Graph(object):
             })
             step_map[step.id] = tool_key
 
-            self.G.nodes[tool_key]['workflow'] = workflow
+            self.G.nodes[tool_key]['workflow'] = handle
             self.G.nodes[tool_key]['workflow_path'
                                    ] = path + '#steps/' + step.id
 
@@ -164,25 +533,33 @@ class Graph(object):
                     other_key = step_map[other_step]
                     self.G.add_edge(other_key, output_map[name], id=id_)
 
+        self.G.graph['workflows'][workflow_key] = [
+            step_map[step.id] for step in workflow.steps
+        ]
         return workflow
 
     def add_tool(
         self, commit, path, file_key=None, expand_workflow=True, is_step=False
     ):
         """Add a tool and its dependencies to the graph."""
-        data = (commit.tree / path).data_stream.read()
-        cwl = yaml.load(data)
+        tool_key = str(commit), str(path)
+        node = self.G.nodes.get(tool_key)
+        if node is not None and node.get('expanded'):
+            if file_key:
+                _, output_path = file_key
+                output_id = node['tool'].get_output_id(output_path)
+                if output_id:
+                    self.G.add_edge(tool_key, file_key, id=output_id)
+            return tool_key
 
-        try:
-            tool = CommandLineTool.from_cwl(cwl)
-        except TypeError:
-            if expand_workflow:
-                return self.add_workflow(
-                    commit, path, file_key=file_key, cwl=cwl
-                )
-            tool = Workflow.from_cwl(cwl)
+        handle = self.cwl_handle(commit, path)
+        tool = handle.tool
+        if isinstance(tool, Workflow) and expand_workflow:
+            return self.add_workflow(
+                commit, path, workflow=tool, file_key=file_key
+            )
 
-        tool_key = self.add_node(commit, path, tool=tool)
+        tool_key = self.add_node(commit, path, tool=handle)
 
         if is_step:
             return tool_key
@@ -190,9 +567,12 @@ class Graph(object):
         for input_path, input_id in self.iter_file_inputs(
             tool, os.path.dirname(path)
         ):
-            input_key = self.add_file(
-                input_path, revision='{0}^'.format(commit)
-            )
+            revision = '{0}^'.format(commit)
+            #: Another command recorded in the same commit generated it.
+            if input_path in _commit_paths(commit) and \
+                    self.find_cwl(commit, input_path) not in {None, path}:
+                revision = str(commit)
+            input_key = self.add_file(input_path, revision=revision)
             #: Edge from an input to the tool.
             self.G.add_edge(input_key, tool_key, id=input_id)
 
@@ -202,25 +582,30 @@ class Graph(object):
             if output_id:
                 self.G.add_edge(tool_key, file_key, id=output_id)
 
+        self.G.nodes[tool_key]['expanded'] = True
         return tool_key
 
     def add_file(self, path, revision='HEAD'):
         """Add a file node to the graph."""
-        file_commits = list(self.client.git.iter_commits(revision, paths=path))
+        commit = self.find_commit(path, revision=revision)
 
-        if not file_commits:
+        if commit is None:
             raise KeyError(
                 'Could not find a file {0} in range {1}'.format(
                     path, revision
                 )
             )
+        commit = self.find_settled(commit, path, revision=revision) or commit
 
-        commit = file_commits[0]
+        file_key = str(commit), str(path)
+        if self.G.nodes.get(file_key, {}).get('expanded'):
+            return file_key
 
-        cwl = self.find_cwl(commit)
+        cwl = self.find_cwl(commit, path)
         if cwl is not None:
             file_key = self.add_node(commit, path)
             self.add_tool(commit, cwl, file_key=file_key)
+            self.G.nodes[file_key]['expanded'] = True
             return file_key
         else:
             #: Does not have a parent CWL.
@@ -236,49 +621,178 @@ class Graph(object):
             ) or str(original_path).startswith('.renku/vendors'):
                 original_path = original_path.resolve()
 
-                for submodule in Submodule.iter_items(
-                    self.client.git, parent_commit=parent_commit
-                ):
+                for submodule in self._submodules(parent_commit):
                     try:
                         subpath = original_path.relative_to(
                             Path(submodule.path).resolve()
                         )
-                        subgraph = Graph(
-                            client=LocalClient(path=submodule.path)
-                        )
+                        subgraph = self._submodule_graph(submodule)
                         subnode = subgraph.add_file(
                             str(subpath), revision=submodule.hexsha
                         )
 
-                        #: Extend node metadata.
-                        for _, data in subgraph.G.nodes(data=True):
-                            data['submodule'
-                                 ] = root_submodule + [submodule.name]
-
                         #: Merge file node with it's symlinked version.
-                        self.G = nx.contracted_nodes(
-                            nx.compose(self.G, subgraph.G),
-                            root_node,
+                        self._merge_lineage(
+                            subgraph.G,
                             subnode,
-                        )  # TODO optionally it can be changed to an edge.
+                            submodule=root_submodule + [submodule.name],
+                        )
+                        self._contract(root_node, subnode)
                         break
                     except ValueError:
                         continue
+            else:
+                #: Vendored files can change without a new commit so they
+                #: are always resolved again.
+                self.G.nodes[root_node]['expanded'] = True
 
             return root_node
 
+    def _submodules(self, commit):
+        """Return submodules defined in the commit."""
+        key = str(commit)
+        if key not in self._submodule_items:
+            self._submodule_items[key] = list(
+                Submodule.iter_items(self.client.git, parent_commit=commit)
+            )
+        return self._submodule_items[key]
+
+    def _submodule_graph(self, submodule):
+        """Return a graph of the submodule at its recorded commit."""
+        key = submodule.path, submodule.hexsha
+        if key not in self._submodule_graphs:
+            client = self._submodule_clients.get(submodule.path)
+            if client is None:
+                client = LocalClient(path=submodule.path)
+                self._submodule_clients[submodule.path] = client
+            self._submodule_graphs[key] = Graph(
+                client=client, cwl_cache=self.cwl_cache
+            )
+        return self._submodule_graphs[key]
+
+    def _merge_lineage(self, G, key, **kwargs):
+        """Merge the node and its ancestors missing in the graph in place.
+
+        Ancestors already present in the graph have been merged before
+        together with their lineage, hence each node is copied only once.
+        """
+        stack = [key]
+        seen = {key}
+        while stack:
+            node = stack.pop()
+            self.G.add_node(node)
+            self.G.nodes[node].update(G.nodes[node])
+            self.G.nodes[node].update(kwargs)
+            for parent, _, data in G.in_edges(node, data=True):
+                if parent not in seen and parent not in self.G:
+                    seen.add(parent)
+                    stack.append(parent)
+                self.G.add_edge(parent, node, **data)
+
+    def _contract(self, u, v):
+        """Contract node ``v`` into node ``u`` in place.
+
+        It is equivalent to :func:`networkx.contracted_nodes` without copying
+        the whole graph.
+        """
+        edges = [(w if w != v else u, u, d)
+                 for w, _, d in self.G.in_edges(v, data=True)]
+        edges.extend((u, w if w != v else u, d)
+                     for _, w, d in self.G.out_edges(v, data=True))
+        v_data = self.G.nodes[v]
+        self.G.remove_node(v)
+        self.G.add_edges_from(edges)
+        self.G.nodes[u].setdefault('contraction', {})[v] = v_data
+
+    def add_files(self, paths, revision='HEAD', jobs=1):
+        """Add file nodes to the graph using a pool of worker processes.
+
+        Files which are not in the graph yet are resolved in chunks by
+        ``jobs`` processes and their subgraphs are merged in order.  A final
+        serial pass over all paths guarantees the same result as calling
+        :meth:`add_file` for each path.  Return keys of the added files.
+        """
+        paths = list(paths)
+
+        if jobs > 1:
+            self.workflow_index()
+            pending = []
+            for path in paths:
+                commit = self.find_commit(path, revision=revision)
+                if commit is not None:
+                    commit = self.find_settled(
+                        commit, path, revision=revision
+                    ) or commit
+                node = self.G.nodes.get((str(commit), path), {})
+                if commit is not None and not node.get('expanded'):
+                    pending.append(path)
+
+            size = max(1, -(-len(pending) // (jobs * 4)))
+            chunks = [
+                pending[index:index + size]
+                for index in range(0, len(pending), size)
+            ]
+
+            if len(chunks) > 1:
+                build = partial(
+                    _build_subgraph,
+                    str(self.client.path),
+                    self.cwl_cache.path,
+                    dumps(self.history),
+                    self.G.graph['workflow_index'],
+                    revision,
+                )
+                with ProcessPoolExecutor(max_workers=jobs) as executor:
+                    for data in executor.map(build, chunks):
+                        self.merge(
+                            loads(
+                                data,
+                                self.client.git,
+                                cwl_cache=self.cwl_cache,
+                            )
+                        )
+
+        return [self.add_file(path, revision=revision) for path in paths]
+
+    def lineage(self, keys):
+        """Return the keys together with all their ancestors.
+
+        Snapshots loaded from the cache contain nodes added by previous
+        commands, hence only the lineage of requested keys is relevant.
+        """
+        nodes = set(keys)
+        stack = list(nodes)
+        while stack:
+            for parent in self.G.predecessors(stack.pop()):
+                if parent not in nodes:
+                    nodes.add(parent)
+                    stack.append(parent)
+        return nodes
+
+    def merge(self, G):
+        """Merge nodes, edges and workflows from another graph in place."""
+        for node, data in G.nodes(data=True):
+            self.G.add_node(node)
+            self.G.nodes[node].update(data)
+        self.G.add_edges_from(G.edges(data=True))
+        self.G.graph['workflows'].update(G.graph.get('workflows', {}))
+
     @property
     def _output_keys(self):
         """Return a list of the output keys."""
         return [n for n, d in self.G.out_degree() if d == 0]
 
     def _need_update(self):
-        """Yield all files that need to be updated."""
-        visited = set()
+        """Propagate bitsets of outdated source nodes to descendants.
+
+        Every node with a newer version gets a bit and each node inherits the
+        bits of its parents, hence nodes without outdated ancestors share the
+        same integer and memory grows only with the number of sources.
+        """
+        sources = []
+        need_update = {}
 
         for key in nx.topological_sort(self.G):
-            assert key not in visited
-            need_update = []
             node = self.G.nodes[key]
             latest = node.get('latest')
 
@@ -289,38 +803,126 @@ class Graph(object):
                         node['latest'] = latest
                         break
 
+            bits = 0
+            for parent in self.G.predecessors(key):
+                parent_bits = need_update[parent]
+                if not bits:
+                    bits = parent_bits
+                elif parent_bits & ~bits:
+                    bits |= parent_bits
+
             if latest:
-                need_update.append(key)
+                bits |= 1 << len(sources)
+                sources.append(key)
 
-            for parent, _ in self.G.in_edges(key):
-                assert parent in visited
-                need_update.extend(self.G.nodes[parent]['_need_update'])
+            need_update[key] = bits
 
-            if not latest and need_update:
-                need_update.append(key)
+        self._sources = sources
+        self._outdated = need_update
 
-            self.G.nodes[key]['_need_update'] = need_update
-            visited.add(key)
+    def is_outdated(self, key):
+        """Check if the node depends on a source with a newer version."""
+        return self.G.nodes[key]['latest'] is None and bool(
+            self._outdated.get(key)
+        )
+
+    def outdated_sources(self, key):
+        """Return source nodes with newer versions the node depends on."""
+        bits = self._outdated.get(key, 0)
+        sources = []
+        while bits:
+            lowest = bits & -bits
+            sources.append(self._sources[lowest.bit_length() - 1])
+            bits ^= lowest
+        return sources
+
+    def execution_plan(self, outputs, clean=()):
+        """Select nodes needed to regenerate the outputs.
+
+        One pass in reverse topological order marks ancestors of the outputs
+        and ancestors of clean nodes; only nodes leading to an output but not
+        to a clean node are kept.  Each selected tool is placed in the wave
+        following the last wave of tools generating its inputs.
+        """
+        outputs = set(outputs)
+        clean = set(clean)
+        order = list(nx.topological_sort(self.G))
+
+        needed = set()
+        clean_parents = set()
+        for key in reversed(order):
+            for child in self.G.successors(key):
+                if child in needed:
+                    needed.add(key)
+                if child in clean or child in clean_parents:
+                    clean_parents.add(key)
+            if key in outputs:
+                needed.add(key)
+
+        plan = ExecutionPlan(nodes=needed - clean_parents)
+
+        depth = {}
+        for key in order:
+            if key not in plan.nodes:
+                continue
+            parents = self.G.predecessors(key)
+            level = max((depth[p] for p in parents if p in depth), default=0)
+            if 'tool' in self.G.nodes[key]:
+                if level == len(plan.waves):
+                    plan.waves.append([])
+                plan.waves[level].append(key)
+                level += 1
+            depth[key] = level
+
+        return plan
+
+    def build_status(self, revision='HEAD', paths=None, jobs=1):
+        """Return files from the revision grouped by their status.
+
+        When ``paths`` are given only their lineage is added to the graph.
+        Versions of files are compared with the ones in the revision.
+        """
+        if revision != self._revision:
+            self._revision = revision
+            for (_, path), data in self.G.nodes(data=True):
+                #: Commits from submodules are compared in their graphs.
+                if not data.get('submodule'):
+                    data['latest'] = self._commit(
+                        self.find_latest(
+                            data['commit'], path, revision=revision
+                        )
+                    )
 
-    def build_status(self, revision='HEAD'):
-        """Return files from the revision grouped by their status."""
         index = self.client.git.index if revision == 'HEAD' \
             else IndexFile.from_tree(self.client.git, revision)
 
-        current_files = set()
+        if paths is None:
+            candidates = (filepath for filepath, _ in index.entries.keys())
+        else:
+            candidates = (
+                filepath
+                for filepath in sorted(paths) if (filepath, 0) in index.entries
+            )
+
+        filepaths = []
 
-        for filepath, _ in index.entries.keys():
+        for filepath in candidates:
             if not filepath.startswith('.renku') and \
                     filepath not in {'.gitignore', '.gitattributes'}:
-                self.add_file(filepath, revision=revision)
-                current_files.add(filepath)
+                filepaths.append(filepath)
+
+        keys = self.add_files(filepaths, revision=revision, jobs=jobs)
+        current_files = set(filepaths)
 
         # Prepare status info for each file.
         self._need_update()
 
+        #: Older versions of files can remain in a cached snapshot.
+        lineage = self.lineage(keys)
         graph_files = sorted(((commit, filepath)
                               for (commit, filepath) in self.G
-                              if filepath in current_files),
+                              if filepath in current_files and
+                              (commit, filepath) in lineage),
                              key=itemgetter(1))
 
         status = {'up-to-date': {}, 'outdated': {}, 'multiple-versions': {}}
@@ -331,19 +933,11 @@ class Graph(object):
             if len(keys) > 1:
                 status['multiple-versions'][filepath] = keys
 
-            nodes = [self.G.nodes[key] for key in keys]
-
             # Any latest version of a file needs an update.
-            is_outdated = any(
-                len(node['_need_update']) > 1
-                for node in nodes if node['latest'] is None
-            )
-
-            if is_outdated:
-                updates = list(
-                    self.G.nodes[key]['_need_update'] for key in keys
-                )
-                status['outdated'][filepath] = updates
+            if any(self.is_outdated(key) for key in keys):
+                status['outdated'][filepath] = [
+                    self.outdated_sources(key) for key in keys
+                ]
             else:
                 status['up-to-date'][filepath] = keys[0][0]
 
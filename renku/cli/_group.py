@@ -28,3 +28,136 @@ class OptionalGroup(click.Group):
         if args and args[0] in self.commands:
             args.insert(0, '')
         super(OptionalGroup, self).parse_args(ctx, args)
+
+
+def _import(import_path):
+    """Return an object from an import path (``module:attribute``)."""
+    module_name, _, attribute = import_path.partition(':')
+    module = __import__(module_name.strip(), fromlist=['__name__'])
+    for name in attribute.split('[')[0].strip().split('.'):
+        module = getattr(module, name)
+    return module
+
+
+def iter_entry_points(group):
+    """Yield names and import paths of entry points in the group.
+
+    Metadata of installed distributions are read directly, because
+    importing ``pkg_resources`` scans all of them and it is slow.
+    """
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        entry_points = None
+
+    if entry_points is not None:
+        selected = entry_points()
+        if hasattr(selected, 'select'):
+            selected = selected.select(group=group)
+        else:
+            selected = selected.get(group, [])
+        for entry_point in selected:
+            yield entry_point.name, entry_point.value
+        return
+
+    import configparser
+    import glob
+    import os
+    import sys
+
+    for path in sys.path:
+        pattern = os.path.join(path or '.', '*.*-info', 'entry_points.txt')
+        for filename in sorted(glob.glob(pattern)):
+            parser = configparser.ConfigParser(
+                delimiters=('=', ), interpolation=None
+            )
+            parser.optionxform = str
+            try:
+                parser.read(filename)
+            except configparser.Error:
+                continue
+            if parser.has_section(group):
+                for name, value in parser.items(group):
+                    yield name.strip(), value.strip()
+
+
+def short_help(command):
+    """Return a short help of the command for all Click versions."""
+    if hasattr(command, 'get_short_help_str'):
+        return command.get_short_help_str()
+    return command.short_help or ''
+
+
+class LazyGroup(click.Group):
+    """Import subcommands only when they are invoked.
+
+    Built-in commands are given as a mapping from a command name to a tuple
+    with an import path (``module:attribute``) and a help line, hence
+    ``renku help`` does not import any command module.  Entry points from
+    the given group are read from distribution metadata and plugins are
+    imported only when they are invoked or listed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Store the lazy commands and the entry point group."""
+        self.lazy_commands = kwargs.pop('lazy_commands', {})
+        self.entry_point_group = kwargs.pop('entry_point_group', None)
+        self._plugins = None
+        super(LazyGroup, self).__init__(*args, **kwargs)
+
+    def plugins(self):
+        """Return import paths of entry points not shadowing commands."""
+        if self._plugins is None:
+            self._plugins = {}
+            if self.entry_point_group:
+                for name, import_path in iter_entry_points(
+                    self.entry_point_group
+                ):
+                    if name not in self.lazy_commands:
+                        self._plugins.setdefault(name, import_path)
+        return self._plugins
+
+    def list_commands(self, ctx):
+        """Return names of all commands without importing them."""
+        names = set(self.commands) | set(self.lazy_commands)
+        return sorted(names | set(self.plugins()))
+
+    def get_command(self, ctx, cmd_name):
+        """Import the command on first access."""
+        if cmd_name in self.commands:
+            return self.commands[cmd_name]
+
+        if cmd_name in self.lazy_commands:
+            command = _import(self.lazy_commands[cmd_name][0])
+        elif cmd_name in self.plugins():
+            try:
+                command = _import(self.plugins()[cmd_name])
+            except Exception:
+                #: A broken plugin must not take down the whole CLI.
+                from click_plugins.core import BrokenCommand
+
+                command = BrokenCommand(cmd_name)
+        else:
+            return
+
+        self.add_command(command, cmd_name)
+        return command
+
+    def format_commands(self, ctx, formatter):
+        """List commands using stored help lines of unloaded commands."""
+        rows = []
+        for name in self.list_commands(ctx):
+            if name not in self.commands and name in self.lazy_commands:
+                help = click.utils.make_default_short_help(
+                    self.lazy_commands[name][1]
+                )
+            else:
+                command = self.get_command(ctx, name)
+                if command is None:
+                    continue
+                help = short_help(command)
+            rows.append((name, help))
+
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(rows)
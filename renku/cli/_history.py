@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2018 - Swiss Data Science Center (SDSC)
+# A partnership between École Polytechnique Fédérale de Lausanne (EPFL) and
+# Eidgenössische Technische Hochschule Zürich (ETHZ).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Index of paths modified by commits in the repository history."""
+
+import re
+import subprocess
+from bisect import bisect_left, bisect_right, insort
+
+import attr
+from git import Commit
+from git.util import hex_to_bin
+
+_RE_HEADER = re.compile(r'^[0-9a-f]{40}( [0-9a-f]{40})* ?$')
+
+
+def _iter_tokens(stream, chunk_size=1 << 16):
+    """Yield NUL separated tokens from a binary stream."""
+    rest = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        tokens = (rest + chunk).split(b'\0')
+        rest = tokens.pop()
+        for token in tokens:
+            yield token.decode('utf-8', 'surrogateescape')
+    if rest:
+        yield rest.decode('utf-8', 'surrogateescape')
+
+
+def _merge_ranges(ranges):
+    """Return sorted disjoint ranges covering the given position ranges."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _last_position(positions, ranges):
+    """Return the highest position within sorted ranges or ``None``."""
+    for low, high in reversed(ranges):
+        index = bisect_right(positions, high)
+        if not index:
+            return
+        if positions[index - 1] >= low:
+            return positions[index - 1]
+
+
+def blob_sha(commit, path):
+    """Return a blob SHA of the path in the commit or ``None``."""
+    try:
+        return (commit.tree / path).binsha
+    except KeyError:
+        return None
+
+
+@attr.s
+class HistoryIndex(object):
+    """Map each path to the ordered list of commits touching it.
+
+    Commits reachable from HEAD get a position in topological order, hence
+    a parent has always a lower position than its children.  The index is
+    built from a single ``git log --name-status`` pass and it can be extended
+    with new commits when HEAD moves forward.
+
+    Consecutive positions forming a chain of single parent commits are
+    grouped in segments.  Ancestors of a commit are described by ranges of
+    positions memoized per segment, hence lookups in merged histories cost
+    the number of segments instead of the number of commits.
+
+    Merges are compared with each of their parents.  Like Git history
+    simplification, a merge touches a path only if it differs from all
+    parents, otherwise the path is looked up in the first parent with the
+    same content (TREESAME).
+    """
+
+    repo = attr.ib()
+
+    head = attr.ib(default=None)
+    """SHA of the last indexed HEAD commit."""
+
+    commits = attr.ib(default=attr.Factory(list))
+    """List of commit SHAs ordered by their position."""
+
+    positions = attr.ib(default=attr.Factory(dict))
+    """Map commit SHAs to their positions."""
+
+    parents = attr.ib(default=attr.Factory(list))
+    """List of tuples with parent positions for each commit."""
+
+    paths = attr.ib(default=attr.Factory(dict))
+    """Map a path to an ascending list of commit positions."""
+
+    merges = attr.ib(default=attr.Factory(dict))
+    """Map a path to an ascending list of merges keeping a parent version."""
+
+    treesame = attr.ib(default=attr.Factory(dict))
+    """Map merge positions and paths to the parent with the same content."""
+
+    linear = attr.ib(default=True)
+    """Indicate that the indexed history does not contain merges."""
+
+    segments = attr.ib(default=attr.Factory(list))
+    """Map commit positions to the first position of their segment."""
+
+    _revisions = attr.ib(default=attr.Factory(dict), repr=False)
+    _below = attr.ib(default=attr.Factory(dict), repr=False)
+
+    def __getstate__(self):
+        """Do not store the repository and resolved revisions."""
+        state = dict(self.__dict__)
+        state['repo'] = None
+        state['_revisions'] = {}
+        state['_below'] = {}
+        return state
+
+    def __setstate__(self, state):
+        """Restore the index state."""
+        self.__dict__.update(state)
+        if 'merges' not in state:
+            #: Older indexes did not compare merges with their parents.
+            self.clear()
+        if 'segments' not in state:
+            self.segments = []
+            for position, parents in enumerate(self.parents):
+                self._add_segment(position, parents)
+
+    def clear(self):
+        """Remove all indexed commits."""
+        self.head = None
+        self.commits = []
+        self.positions = {}
+        self.parents = []
+        self.paths = {}
+        self.merges = {}
+        self.treesame = {}
+        self.linear = True
+        self.segments = []
+        self._revisions.clear()
+        self._below.clear()
+
+    def _add_segment(self, position, parents):
+        """Extend the segment of the only parent or start a new one."""
+        if parents == (position - 1, ):
+            self.segments.append(self.segments[position - 1])
+        else:
+            self.segments.append(position)
+
+    def update(self):
+        """Index commits reachable from HEAD and return modified paths."""
+        try:
+            head = self.repo.head.commit.hexsha
+        except ValueError:
+            return set()
+
+        if head == self.head:
+            return set()
+
+        self._revisions.clear()
+        if self.head and not self.repo.is_ancestor(self.head, head):
+            self.clear()
+
+        revision = head if not self.head else '{0}..{1}'.format(
+            self.head, head
+        )
+        process = self.repo.git.log(
+            '--topo-order',
+            '--reverse',
+            '--no-renames',
+            '--name-status',
+            '--format=%H %P',
+            '-z',
+            revision,
+            as_process=True,
+        )
+
+        modified = set()
+        merges = []
+        position = None
+        expect_path = False
+        for token in _iter_tokens(process.proc.stdout):
+            token = token.lstrip('\n')
+            if expect_path:
+                self.paths.setdefault(token, []).append(position)
+                modified.add(token)
+                expect_path = False
+            elif _RE_HEADER.match(token):
+                sha, *parents = token.split()
+                position = len(self.commits)
+                self.commits.append(sha)
+                self.positions[sha] = position
+                parents = tuple(self.positions[parent] for parent in parents)
+                self.parents.append(parents)
+                self._add_segment(position, parents)
+                self.linear = self.linear and len(parents) < 2
+                if len(parents) > 1:
+                    merges.append(position)
+            elif token:
+                expect_path = True
+
+        process.wait()
+        self._index_merges(merges, modified)
+        self.head = head
+        return modified
+
+    def _index_merges(self, merges, modified):
+        """Index paths of merges compared with each of their parents."""
+        if not merges:
+            return
+
+        headers = [
+            self.commits[position] for position in merges
+            for _ in self.parents[position]
+        ]
+        stdin = ''.join(
+            '{0} {1}\n'.format(self.commits[position], self.commits[parent])
+            for position in merges for parent in self.parents[position]
+        )
+        process = self.repo.git.diff_tree(
+            '--stdin',
+            '--always',
+            '-r',
+            '--no-renames',
+            '--name-only',
+            '-z',
+            as_process=True,
+            istream=subprocess.PIPE,
+        )
+        output, _ = process.proc.communicate(stdin.encode('utf-8'))
+
+        #: Each line of the input prints a header even for an empty diff.
+        diffs = []
+        for token in output.decode('utf-8', 'surrogateescape').split('\0'):
+            token = token.lstrip('\n')
+            if len(diffs) < len(headers) and token == headers[len(diffs)]:
+                diffs.append(set())
+            elif token:
+                diffs[-1].add(token)
+
+        start = 0
+        for position in merges:
+            parents = self.parents[position]
+            parent_diffs = diffs[start:start + len(parents)]
+            start += len(parents)
+
+            changed = set().union(*parent_diffs)
+            modified |= changed
+            for path in changed:
+                same = [
+                    parent for parent, diff in zip(parents, parent_diffs)
+                    if path not in diff
+                ]
+                if same:
+                    self.merges.setdefault(path, []).append(position)
+                    self.treesame.setdefault(position, {})[path] = same[0]
+                else:
+                    insort(self.paths.setdefault(path, []), position)
+
+    def commit(self, position):
+        """Return a commit instance for the given position."""
+        return Commit(self.repo, hex_to_bin(self.commits[position]))
+
+    def position(self, revision):
+        """Return a position of the revision or ``None`` if not indexed."""
+        if isinstance(revision, Commit):
+            return self.positions.get(revision.hexsha)
+
+        if revision in self._revisions:
+            return self._revisions[revision]
+
+        position = None
+        if revision == 'HEAD':
+            position = self.positions.get(self.head)
+        elif revision.endswith('^') and revision[:-1] in self.positions:
+            parents = self.parents[self.positions[revision[:-1]]]
+            position = parents[0] if parents else None
+        else:
+            try:
+                sha = self.repo.rev_parse(revision).hexsha
+                position = self.positions.get(sha)
+            except Exception:
+                pass
+
+        self._revisions[revision] = position
+        return position
+
+    def _ranges_below(self, segment):
+        """Return ranges of positions reachable from parents of a segment."""
+        stack = [segment]
+        while stack:
+            start = stack[-1]
+            if start in self._below:
+                stack.pop()
+                continue
+
+            parents = self.parents[start]
+            pending = [
+                self.segments[parent] for parent in parents
+                if self.segments[parent] not in self._below
+            ]
+            if pending:
+                stack.extend(pending)
+                continue
+
+            stack.pop()
+            ranges = []
+            for parent in parents:
+                ranges.append((self.segments[parent], parent))
+                ranges.extend(self._below[self.segments[parent]])
+            self._below[start] = _merge_ranges(ranges)
+        return self._below[segment]
+
+    def ancestors(self, position):
+        """Return sorted ranges of positions reachable from the position."""
+        if self.linear or self.commits[position] == self.head:
+            return [(0, position)]
+
+        segment = self.segments[position]
+        return _merge_ranges([(segment, position)] +
+                             self._ranges_below(segment))
+
+    def prefix_paths(self, prefix, start=0):
+        """Map positions from the start to paths touched in the folder."""
+        folder = prefix.rstrip('/') + '/'
+        paths = {}
+        for path, positions in self.paths.items():
+            if path.startswith(folder):
+                for position in positions[bisect_left(positions, start):]:
+                    paths.setdefault(position, []).append(path)
+        return paths
+
+    def is_ancestor(self, ancestor, position):
+        """Check that a position is reachable from the other position."""
+        return any(
+            low <= ancestor <= high for low, high in self.ancestors(position)
+        )
+
+    def last_commit(self, path, revision='HEAD'):
+        """Return the last commit touching the path at the revision.
+
+        Raise ``KeyError`` if the revision is not indexed.
+        """
+        position = self.position(revision)
+        if position is None:
+            raise KeyError(revision)
+
+        candidates = self.paths.get(path, [])
+        merges = self.merges.get(path, [])
+        while True:
+            ranges = self.ancestors(position)
+            touched = _last_position(candidates, ranges)
+            merged = _last_position(merges, ranges)
+            if merged is None or (touched is not None and touched > merged):
+                break
+            #: The merge kept the content of a parent, hence continue there.
+            position = self.treesame[merged][path]
+
+        if touched is not None:
+            return self.commit(touched)
+
+    def next_commit(self, path, start):
+        """Return the first commit touching the path after the start.
+
+        Raise ``KeyError`` if the start is not indexed.
+        """
+        position = self.position(start)
+        if position is None:
+            raise KeyError(start)
+
+        candidates = self.paths.get(path, [])
+        if not candidates:
+            return
+
+        #: Commits from merged branches can have lower positions than the
+        #: start, hence the first candidate in a gap between ancestors wins.
+        covered = 0
+        for low, high in self.ancestors(position):
+            index = bisect_left(candidates, covered)
+            if index < len(candidates) and candidates[index] < low:
+                return self.commit(candidates[index])
+            covered = high + 1
+
+        index = bisect_left(candidates, covered)
+        if index < len(candidates):
+            return self.commit(candidates[index])
+
+    def newer_commit(self, path, start, revision='HEAD'):
+        """Return the last commit in the revision if the content changed.
+
+        The blob of the path in the start is compared with the blob in the
+        revision, hence reverted or re-added content is not newer.
+        Raise ``KeyError`` if the start or the revision is not indexed.
+        """
+        if self.position(start) is None:
+            raise KeyError(start)
+
+        commit = self.last_commit(path, revision=revision)
+        if commit is None or commit.hexsha == str(start):
+            return
+
+        if not isinstance(start, Commit):
+            start = self.repo.commit(start)
+        if blob_sha(start, path) != blob_sha(commit, path):
+            return commit
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2018 - Swiss Data Science Center (SDSC)
+# A partnership between École Polytechnique Fédérale de Lausanne (EPFL) and
+# Eidgenössische Technische Hochschule Zürich (ETHZ).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Record resources used by executed tools."""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import attr
+
+from ._cache import write_atomic
+
+
+@attr.s
+class Usage(object):
+    """Represent resources used by one execution of a tool."""
+
+    wall_time = attr.ib(default=0.0)
+    """Elapsed time in seconds."""
+
+    exit_code = attr.ib(default=None)
+
+    user_time = attr.ib(default=None)
+    """CPU time spent in user mode in seconds."""
+
+    system_time = attr.ib(default=None)
+    """CPU time spent in kernel mode in seconds."""
+
+    max_rss = attr.ib(default=None)
+    """Maximum resident set size in bytes."""
+
+    read_bytes = attr.ib(default=None)
+    """Bytes read from block devices."""
+
+    written_bytes = attr.ib(default=None)
+    """Bytes written to block devices."""
+
+    timestamp = attr.ib(default=attr.Factory(time.time))
+    """Time of the execution in seconds since the epoch."""
+
+
+#: Units of ``ru_maxrss`` in bytes.
+_RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+#: Size of blocks counted by ``ru_inblock`` and ``ru_oublock``.
+_BLOCK_SIZE = 512
+
+
+def _exit_code(status):
+    """Convert a wait status to an exit code like ``Popen.returncode``."""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def wait(process, start):
+    """Wait for the process and return resources used by it.
+
+    Platforms without ``os.wait4`` report only the wall time.
+    """
+    try:
+        _, status, rusage = os.wait4(process.pid, 0)
+    except (AttributeError, ChildProcessError):
+        #: The process could have been reaped while being terminated.
+        returncode = process.wait()
+        return Usage(wall_time=time.monotonic() - start, exit_code=returncode)
+
+    wall_time = time.monotonic() - start
+    process.returncode = _exit_code(status)
+    return Usage(
+        wall_time=wall_time,
+        exit_code=process.returncode,
+        user_time=rusage.ru_utime,
+        system_time=rusage.ru_stime,
+        max_rss=rusage.ru_maxrss * _RSS_UNIT,
+        read_bytes=rusage.ru_inblock * _BLOCK_SIZE,
+        written_bytes=rusage.ru_oublock * _BLOCK_SIZE,
+    )
+
+
+def execute(args, **kwargs):
+    """Run a command and return resources used by it."""
+    start = time.monotonic()
+    return wait(subprocess.Popen(args, **kwargs), start)
+
+
+@attr.s
+class UsageLog(object):
+    """Keep recent usage of tools in files next to their CWL files."""
+
+    client = attr.ib()
+
+    SUFFIX = '.usage.json'
+    """Suffix replacing the extension of the CWL file."""
+
+    MAX_RECORDS = 20
+    """Number of recent executions kept for each tool."""
+
+    _lock = attr.ib(init=False, default=attr.Factory(threading.Lock))
+
+    def path(self, tool_path):
+        """Return a path of the usage file or ``None`` outside of workflows."""
+        path = self.client.path / (
+            os.path.splitext(tool_path)[0] + self.SUFFIX
+        )
+        if path.parent.resolve() == self.client.workflow_path.resolve():
+            return path
+
+    def load(self, tool_path):
+        """Return a list of recorded usages of the tool."""
+        path = self.path(tool_path)
+        if path is None or not path.exists():
+            return []
+
+        try:
+            with path.open('r') as fp:
+                return [Usage(**record) for record in json.load(fp)]
+        except (OSError, ValueError, TypeError):
+            return []
+
+    def record(self, tool_path, usage):
+        """Append the usage and drop the oldest records."""
+        path = self.path(tool_path)
+        if path is None:
+            return
+
+        with self._lock:
+            records = self.load(tool_path) + [usage]
+            data = [attr.asdict(r) for r in records[-self.MAX_RECORDS:]]
+            write_atomic(path, json.dumps(data, indent=2).encode('utf-8'))
+
+    def estimate(self, tool_path):
+        """Return average usage of the tool or ``None`` if never executed."""
+        records = self.load(tool_path)
+        if not records:
+            return
+
+        cpu_times = [
+            r.user_time + r.system_time
+            for r in records if r.user_time is not None
+        ]
+        max_rss = [r.max_rss for r in records if r.max_rss is not None]
+        return {
+            'runs': len(records),
+            'wall_time': sum(r.wall_time for r in records) / len(records),
+            'cpu_time': sum(cpu_times) / len(cpu_times) if cpu_times else None,
+            'max_rss': max(max_rss, default=None),
+        }
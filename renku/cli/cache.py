@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2018 - Swiss Data Science Center (SDSC)
+# A partnership between École Polytechnique Fédérale de Lausanne (EPFL) and
+# Eidgenössische Technische Hochschule Zürich (ETHZ).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Manage caches stored in the Renku folder.
+
+Statistics
+~~~~~~~~~~
+
+The run cache allows ``renku run --cache`` and ``renku update --cache`` to
+restore outputs of a tool executed with the same command line and identical
+input files instead of running it again.  Only commands executed with
+``--cache`` record their outputs.  The CWL cache stores parsed workflow files
+used to build the provenance graph.
+
+.. code-block:: console
+
+    $ renku cache stats
+    Run cache:
+      Entries: 12
+      Size: 1508 bytes
+      Hits: 4
+      Misses: 9
+    CWL cache:
+      Entries: 25
+      Size: 61440 bytes
+      Hits: 130
+      Disk hits: 48
+      Misses: 25
+
+Eviction
+~~~~~~~~
+
+Entries of the run cache which were not used recently can be removed.
+
+.. code-block:: console
+
+    $ renku cache evict --older-than 30 --max-entries 1000
+
+All caches can be safely removed at any time.  Worktrees of commands
+executed with ``renku run --isolation`` are kept.
+
+.. code-block:: console
+
+    $ renku cache clear
+"""
+
+import shutil
+
+import click
+
+from ._cache import CWLCache, RunCache
+from ._client import pass_local_client
+
+
+@click.group()
+def cache():
+    """Manage caches."""
+
+
+@cache.command()
+@pass_local_client
+def stats(client):
+    """Show statistics of the run and CWL caches."""
+    stats = RunCache(client).stats()
+    click.echo('Run cache:')
+    click.echo('  Entries: {entries}'.format(**stats))
+    click.echo('  Size: {size} bytes'.format(**stats))
+    click.echo('  Hits: {hits}'.format(**stats))
+    click.echo('  Misses: {misses}'.format(**stats))
+
+    stats = CWLCache(path=client.cache_path / 'cwl').disk_stats()
+    click.echo('CWL cache:')
+    click.echo('  Entries: {entries}'.format(**stats))
+    click.echo('  Size: {size} bytes'.format(**stats))
+    click.echo('  Hits: {hits}'.format(**stats))
+    click.echo('  Disk hits: {disk_hits}'.format(**stats))
+    click.echo('  Misses: {misses}'.format(**stats))
+
+
+@cache.command()
+@click.option(
+    '--older-than',
+    metavar='<days>',
+    type=click.IntRange(min=0),
+    help='Remove entries not used in the given number of days.',
+)
+@click.option(
+    '--max-entries',
+    metavar='<n>',
+    type=click.IntRange(min=0),
+    help='Keep only the given number of recently used entries.',
+)
+@pass_local_client
+def evict(client, older_than, max_entries):
+    """Remove entries of the run cache."""
+    removed = RunCache(client).evict(
+        older_than=older_than * 24 * 60 * 60
+        if older_than is not None else None,
+        max_entries=max_entries,
+    )
+    click.echo('Removed {0} entries.'.format(removed))
+
+
+@cache.command()
+@pass_local_client
+def clear(client):
+    """Remove all caches."""
+    for path in client.cache_path.iterdir():
+        if path.name in {'.gitignore', 'worktrees'}:
+            continue
+        if path.is_dir():
+            shutil.rmtree(str(path))
+        else:
+            path.unlink()
+
+    #: Forget worktrees whose folders were removed.
+    client.git.git.worktree('prune')
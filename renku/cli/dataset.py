@@ -42,7 +42,7 @@ from click import BadParameter
 from renku.models.datasets import Author
 
 from ._client import pass_local_client
-from ._git import with_git
+from ._git import stage_paths, with_git
 
 
 @click.group()
@@ -64,6 +64,7 @@ def create(client, name):
         author = Author.from_git(client.git)
         if author not in dataset.authors:
             dataset.authors.append(author)
+    stage_paths(client.path / client.datadir / name)
     click.secho('OK', fg='green')
 
 
@@ -89,6 +90,11 @@ def add(client, name, url, nocopy, target):
             client.add_data_to_dataset(
                 dataset, url, nocopy=nocopy, target=target
             )
+        stage_paths(
+            client.path / client.datadir / name,
+            client.path / '.gitattributes',
+            client.path / '.gitmodules',
+        )
         click.secho('OK', fg='green')
     except FileNotFoundError:
         click.secho('ERROR', fg='red')
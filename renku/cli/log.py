@@ -31,8 +31,11 @@ from ._graph import Graph
 @pass_local_client
 def log(client, revision, path):
     """Show logs for a file."""
-    graph = Graph(client)
-    for p in path:
-        graph.add_file(p, revision=revision)
+    graph = Graph(client, use_cache=True)
+    keys = [graph.add_file(p, revision=revision) for p in path]
+    graph.save_cache()
+
+    lineage = graph.lineage(keys)
+    graph.G.remove_nodes_from([n for n in graph.G if n not in lineage])
 
     echo_via_pager(DAG(graph=graph))
@@ -15,18 +15,82 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-"""Track provenance of data created by executing programs."""
+"""Track provenance of data created by executing programs.
+
+Run cache
+~~~~~~~~~
+
+With ``--cache`` outputs of a tracked command are stored in the run cache
+and the command is not executed when the cache contains outputs of the same
+command line with identical input files; the outputs are restored and the
+command is recorded as if it ran.
+
+.. code-block:: console
+
+    $ renku run --cache python train.py data.csv model.pkl
+
+.. warning::
+
+   The cache key covers only the command line, redirected streams and the
+   content of arguments recognized as files.  Do not use ``--cache`` for
+   commands reading other files, environment variables or the network,
+   because their outputs would be restored even when these inputs changed.
+
+Isolated execution
+~~~~~~~~~~~~~~~~~~
+
+By default only one tracked command can run at a time in a repository.
+With ``--isolation`` the command runs in a temporary Git worktree checked
+out from the current ``HEAD`` and the resulting commit is merged back once
+the command finishes, hence many commands can run concurrently.
+
+.. code-block:: console
+
+    $ renku run --isolation python train.py --seed 1 &
+    $ renku run --isolation python train.py --seed 2 &
+
+Files redirected from standard streams are read and written in the
+worktree.  The run cache can not be used with isolated commands.
+
+Batch execution
+~~~~~~~~~~~~~~~
+
+Many commands, e.g. from a parameter sweep, can be listed in a manifest
+file with one command line per line.  Empty lines and lines starting with
+``#`` are skipped.  All commands are recorded in a single commit.
+
+.. code-block:: console
+
+    $ cat sweep.txt
+    python train.py --seed 1 --output model1.pkl
+    python train.py --seed 2 --output model2.pkl
+    $ renku run --manifest sweep.txt --jobs 2
+
+Commands run one after another by default, hence a command can read files
+generated by previous commands and the lineage is recorded.  When commands
+run concurrently, each modified file has to be named in the arguments of
+exactly one command.
+"""
 
 import os
+import shlex
 import sys
-from subprocess import call
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 
 import click
+from git import GitCommandError
 
-from renku.models.cwl.command_line_tool import CommandLineToolFactory
+from renku import errors
+from renku.api import LocalClient
+from renku.models.cwl.command_line_tool import CommandLineToolFactory, \
+    modified_paths, repository_snapshot
 
+from ._cache import RunCache
 from ._client import pass_local_client
-from ._git import _mapped_std_streams, with_git
+from ._executor import Step
+from ._git import _mapped_std_streams, stage_paths, with_git, with_worktree
+from ._usage import UsageLog, execute
 
 
 @click.command(context_settings=dict(ignore_unknown_options=True, ))
@@ -36,26 +100,305 @@ from ._git import _mapped_std_streams, with_git
     default=False,
     help='Allow commands without output files.'
 )
+@click.option(
+    '--cache/--no-cache',
+    default=False,
+    help='Restore outputs of an identical earlier execution instead of '
+    'executing the command.  Only arguments recognized as files are '
+    'compared.'
+)
+@click.option(
+    '--isolation',
+    is_flag=True,
+    default=False,
+    help='Execute the command in a temporary worktree and merge the result.'
+)
+@click.option(
+    '--manifest',
+    type=click.File('r'),
+    default=None,
+    help='Execute command lines listed in the file.'
+)
+@click.option(
+    '--jobs',
+    default=1,
+    type=click.IntRange(min=1),
+    help='Number of commands from the manifest executed concurrently.',
+)
 @click.argument('command_line', nargs=-1, type=click.UNPROCESSED)
 @pass_local_client
-@with_git(clean=True, up_to_date=True, commit=True, ignore_std_streams=True)
-def run(client, no_output, command_line):
+def run(client, no_output, cache, isolation, manifest, jobs, command_line):
     """Tracking work on a specific problem."""
-    candidates = [x[0] for x in client.git.index.entries] + \
-        client.git.untracked_files
-    mapped_std = _mapped_std_streams(candidates)
-    factory = CommandLineToolFactory(command_line=command_line, **mapped_std)
+    if manifest is not None:
+        if command_line or isolation:
+            raise click.UsageError(
+                'Option "--manifest" can not be used with a command line '
+                'or with "--isolation".'
+            )
+        with with_git(clean=True, up_to_date=True, commit=True):
+            command_lines = [
+                shlex.split(line) for line in manifest
+                if line.strip() and not line.lstrip().startswith('#')
+            ]
+            stage_paths(
+                *_track_batch(
+                    client, command_lines, jobs=jobs, no_output=no_output
+                )
+            )
+        return
+
+    if isolation:
+        if cache:
+            raise click.UsageError(
+                'Option "--cache" can not be used with "--isolation".'
+            )
+        _run_isolated(client, no_output, command_line)
+        return
 
+    with with_git(
+        clean=True, up_to_date=True, commit=True, ignore_std_streams=True
+    ):
+        mapped_std = _mapped_std_streams(client.git)
+        factory = CommandLineToolFactory(
+            command_line=command_line, **mapped_std
+        )
+        paths = _track(
+            client,
+            factory,
+            {key: getattr(sys, key)
+             for key in mapped_std},
+            no_output=no_output,
+            run_cache=RunCache(client) if cache else None,
+        )
+        if paths is not None:
+            stage_paths(*paths)
+
+
+def _track(client, factory, streams, no_output=False, run_cache=None):
+    """Execute the command and store it as a new workflow step.
+
+    With ``run_cache`` outputs are restored from it instead of executing the
+    command and outputs of an executed command are recorded in it.  Return
+    paths modified by the command or ``None`` if not known.
+    """
     with client.with_workflow_storage() as wf:
         with factory.watch(client, no_output=no_output) as tool:
-            call(
-                factory.command_line,
-                cwd=os.getcwd(),
-                **{key: getattr(sys, key)
-                   for key in mapped_std.keys()},
-            )
+            cache_key = run_cache.key(_repository_step(client, tool)
+                                      ) if run_cache else None
+            usage = None
+            if run_cache and run_cache.restore(cache_key) is not None:
+                click.echo('Outputs were restored from the cache.', err=True)
+            else:
+                usage = execute(
+                    factory.command_line, cwd=os.getcwd(), **streams
+                )
 
             sys.stdout.flush()
             sys.stderr.flush()
 
             wf.add_step(run=tool)
+
+        outputs = _repository_step(client, tool).outputs
+        if run_cache and usage is not None:
+            run_cache.record(cache_key, outputs)
+
+    tool_path = str(
+        client.workflow_step_path(wf.steps[-1]).relative_to(client.path)
+    )
+    usage_log = UsageLog(client)
+    if usage is not None:
+        usage_log.record(tool_path, usage)
+
+    if outputs is not None:
+        return [
+            client.path / tool_path,
+            usage_log.path(tool_path),
+            client.path / '.gitattributes',
+        ] + [client.path / output for output in outputs]
+
+
+def _repository_step(client, tool):
+    """Return a step of the tool with paths relative to the repository.
+
+    Arguments are relative to the working directory while redirected
+    streams are mapped relative to the repository already.
+    """
+    prefix = os.path.relpath(os.getcwd(), str(client.path))
+    step = Step.from_node(None, tool, basedir='')
+    streams = {step.stdin, step.stdout, step.stderr}
+
+    def resolve(path):
+        """Resolve a path from the working directory."""
+        if path in streams:
+            return path
+        return os.path.normpath(os.path.join(prefix, path))
+
+    step.inputs = [resolve(path) for path in step.inputs]
+    if step.outputs is not None:
+        step.outputs = [resolve(path) for path in step.outputs]
+    return step
+
+
+def _track_batch(client, command_lines, jobs=1, no_output=False):
+    """Execute commands and store them as workflow steps in one transaction.
+
+    Return paths modified by the commands.
+    """
+    cwd = os.getcwd()
+
+    before = repository_snapshot(client)
+    if jobs == 1:
+        factories = []
+        tools = []
+        usages = []
+        candidates = []
+        for command_line in command_lines:
+            #: Arguments are recognized as input files only if they exist,
+            #: hence outputs of previous commands are inputs of this one.
+            factory = CommandLineToolFactory(command_line=command_line)
+            factories.append(factory)
+            tools.append(factory.generate_tool())
+            usages.append(execute(factory.command_line, cwd=cwd))
+            after = repository_snapshot(client)
+            candidates.append(modified_paths(client, before, after))
+            before = after
+    else:
+        factories = [
+            CommandLineToolFactory(command_line=command_line)
+            for command_line in command_lines
+        ]
+        tools = [factory.generate_tool() for factory in factories]
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            usages = list(
+                executor.map(
+                    lambda factory: execute(factory.command_line, cwd=cwd),
+                    factories,
+                )
+            )
+        candidates = _assign_paths(
+            factories,
+            modified_paths(client, before, repository_snapshot(client)),
+        )
+
+    outputs = []
+    for factory, tool, paths in zip(factories, tools, candidates):
+        outputs.extend(factory.add_outputs(tool, paths, no_output=no_output))
+    client.track_paths_in_storage(*outputs)
+
+    with client.with_workflow_storage() as wf:
+        for tool in tools:
+            wf.add_step(run=tool)
+
+    usage_log = UsageLog(client)
+    paths = [client.path / '.gitattributes']
+    for step, usage in zip(wf.steps, usages):
+        tool_path = str(
+            client.workflow_step_path(step).relative_to(client.path)
+        )
+        usage_log.record(tool_path, usage)
+        paths.extend([client.path / tool_path, usage_log.path(tool_path)])
+
+    return paths + [os.path.abspath(output) for output in outputs]
+
+
+def _assign_paths(factories, paths):
+    """Assign each path to the only command naming it in arguments."""
+    arguments = [{
+        os.path.normpath(str(input_.default))
+        for input_ in factory.inputs
+    } for factory in factories]
+    assigned = [[] for _ in factories]
+
+    for path in paths:
+        owners = [
+            index for index, names in enumerate(arguments) if path in names
+        ]
+        if len(owners) != 1:
+            raise click.UsageError(
+                'Can not determine which command modified "{0}". '
+                'Please use "--jobs 1".'.format(path)
+            )
+        assigned[owners[0]].append(path)
+
+    return assigned
+
+
+def _run_isolated(client, no_output, command_line):
+    """Execute the command in a worktree and merge the new commit."""
+    mapped_std = _mapped_std_streams(client.git)
+    cwd = os.getcwd()
+    prefix = os.path.relpath(cwd, str(client.path))
+    message = ' '.join(sys.argv)
+
+    with with_worktree(client.git, client.cache_path / 'worktrees') as repo:
+        worktree = LocalClient(path=repo.working_tree_dir)
+        factory = CommandLineToolFactory(
+            command_line=command_line, **mapped_std
+        )
+        try:
+            os.chdir(os.path.join(repo.working_tree_dir, prefix))
+            with ExitStack() as stack:
+                streams = {
+                    key: stack.enter_context(
+                        open(
+                            os.path.join(repo.working_tree_dir, path), 'rb'
+                            if key == 'stdin' else 'wb'
+                        )
+                    )
+                    for key, path in mapped_std.items()
+                }
+                paths = _track(worktree, factory, streams, no_output=no_output)
+
+            if paths is None:
+                repo.git.add('--all')
+            else:
+                repo.git.add(
+                    '--all', '--',
+                    *(str(path) for path in paths if os.path.lexists(path))
+                )
+            commit = repo.index.commit(message)
+        finally:
+            os.chdir(cwd)
+
+    with client.lock:
+        _union_merge_attributes(client)
+
+        #: Discard files truncated for redirected output by the shell.
+        for key, path in mapped_std.items():
+            if key == 'stdin':
+                continue
+            if client.git.git.ls_files('--', path):
+                client.git.git.checkout('--', path)
+            else:
+                os.unlink(os.path.join(str(client.path), path))
+
+        try:
+            client.git.git.merge('--no-edit', '-m', message, commit.hexsha)
+        except GitCommandError:
+            try:
+                client.git.git.merge('--abort')
+            except GitCommandError:
+                pass
+            raise errors.FailedMerge(commit)
+
+
+def _union_merge_attributes(client):
+    """Merge lines appended to ``.gitattributes`` by concurrent commands.
+
+    Each isolated command tracks its outputs in the external storage, hence
+    the attribute is set in the repository configuration and not committed.
+    """
+    line = '/.gitattributes merge=union\n'
+    path = os.path.join(client.git.git_dir, 'info', 'attributes')
+    content = ''
+    if os.path.exists(path):
+        with open(path) as fp:
+            content = fp.read()
+    if line in content:
+        return
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as fp:
+        if content and not content.endswith('\n'):
+            fp.write('\n')
+        fp.write(line)
@@ -17,25 +17,50 @@
 # limitations under the License.
 """Show status of data created in Renku repository."""
 
+import os
+
 import click
 
 from ._ascii import _format_sha1
 from ._client import pass_local_client
-from ._git import with_git
+from ._git import _changed_paths, with_git
 from ._graph import Graph
 
 
 @click.command()
 @click.option('--revision', default='HEAD')
+@click.option(
+    '--changed-since',
+    metavar='<rev>',
+    help='Only consider files modified after the given revision and '
+    'files generated from them.',
+)
+@click.option(
+    '-j',
+    '--jobs',
+    default=1,
+    type=click.IntRange(min=1),
+    help='Number of processes used to build the graph.',
+)
 @click.argument('path', type=click.Path(exists=True, dir_okay=False), nargs=-1)
 @pass_local_client
 @click.pass_context
 @with_git(commit=False)
-def status(ctx, client, revision, path):
+def status(ctx, client, revision, changed_since, jobs, path):
     """Show a status of the repository."""
-    paths = set(path)
-    graph = Graph(client)
-    status = graph.build_status(revision=revision)
+    paths = {
+        os.path.relpath(os.path.abspath(p), str(client.path))
+        for p in path
+    } or None
+    graph = Graph(client, use_cache=True)
+    if changed_since:
+        changed = _changed_paths(client.git, changed_since, revision=revision)
+        #: Outputs generated from changed inputs can be outdated.
+        changed |= graph.downstream_paths(changed)
+        paths = changed if paths is None else paths & changed
+
+    status = graph.build_status(revision=revision, paths=paths, jobs=jobs)
+    graph.save_cache()
 
     click.echo('On branch {0}'.format(client.git.active_branch))
     if status['outdated']:
@@ -15,33 +15,87 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-"""Update an existing file."""
+"""Update an existing file.
 
+Execution plan
+~~~~~~~~~~~~~~
+
+Steps which would be executed can be listed without running them.  Steps
+are grouped in waves of steps which can run concurrently and each one shows
+the inputs that triggered it together with an estimate based on recorded
+executions of the same tool.
+
+.. code-block:: console
+
+    $ renku update --dry-run
+    $ renku update --dry-run --json
+
+Run cache
+~~~~~~~~~
+
+With ``--cache`` outputs of steps are restored from the run cache when the
+same command line was executed with identical input files, otherwise they
+are recorded in it.  The same limitations as for ``renku run --cache``
+apply.
+
+.. code-block:: console
+
+    $ renku update --cache
+"""
+
+import json
 import uuid
-from subprocess import call
 
 import click
-import networkx as nx
 import yaml
 
 from renku.models.cwl._ascwl import ascwl
 
+from ._cache import RunCache
 from ._client import pass_local_client
+from ._executor import EarlyCutoff, LocalExecutor, Step
 from ._git import with_git
 from ._graph import Graph
+from ._usage import UsageLog
 
 
 @click.command()
 @click.option('--revision', default='HEAD')
+@click.option(
+    '-j',
+    '--jobs',
+    default=1,
+    type=click.IntRange(min=1),
+    help='Number of steps executed concurrently.',
+)
+@click.option(
+    '--cache/--no-cache',
+    default=False,
+    help='Restore outputs of identical earlier executions instead of '
+    'executing steps.  Only arguments recognized as files are compared.'
+)
+@click.option(
+    '--dry-run',
+    is_flag=True,
+    default=False,
+    help='Show the execution plan without running it.'
+)
+@click.option(
+    'as_json',
+    '--json',
+    is_flag=True,
+    default=False,
+    help='Print the execution plan as JSON (implies --dry-run).'
+)
 @click.argument(
     'paths', type=click.Path(exists=True, dir_okay=False), nargs=-1
 )
 @pass_local_client
 @click.pass_context
 @with_git()
-def update(ctx, client, revision, paths):
+def update(ctx, client, revision, jobs, cache, dry_run, as_json, paths):
     """Update existing files by rerunning their outdated workflow."""
-    graph = Graph(client)
+    graph = Graph(client, use_cache=True)
 
     status = graph.build_status(revision=revision)
 
@@ -53,20 +107,22 @@ def update(ctx, client, revision, paths):
     else:
         outputs = {graph.add_file(path, revision=revision) for path in paths}
 
-    # Get parents of all clean nodes
-    clean_paths = status['up-to-date'].keys()
-    clean_nodes = {(c, p) for (c, p) in graph.G if p in clean_paths}
-    clean_parents = set()
-    for key in clean_nodes:
-        clean_parents |= nx.ancestors(graph.G, key)
+    graph.save_cache()
 
-    subnodes = set()
-    for key in outputs:
-        if key in graph.G:
-            subnodes |= nx.shortest_path_length(graph.G, target=key).keys()
+    clean_paths = status['up-to-date'].keys()
+    clean = {(c, p) for (c, p) in graph.G if p in clean_paths}
+    plan = graph.execution_plan(outputs, clean=clean)
+    graph.G.remove_nodes_from([n for n in graph.G if n not in plan.nodes])
 
-    graph.G.remove_nodes_from(clean_parents)
-    graph.G.remove_nodes_from([n for n in graph.G if n not in subnodes])
+    usage_log = UsageLog(client)
+    if dry_run or as_json:
+        description = _describe_plan(graph, plan, usage_log)
+        if as_json:
+            click.echo(json.dumps(description, indent=2))
+        else:
+            _echo_plan(description)
+        #: Leave without committing.
+        ctx.exit()
 
     output_file = client.workflow_path / '{0}.cwl'.format(uuid.uuid4().hex)
     with open(output_file, 'w') as f:
@@ -82,4 +138,109 @@ def update(ctx, client, revision, paths):
         )
 
     # TODO remove existing outputs?
-    call(['cwl-runner', str(output_file)])
+    cutoff = EarlyCutoff(client, graph.G)
+    waves = ([Step.from_node(key, graph.G.nodes[key]['tool']) for key in wave]
+             for wave in cutoff.filter(plan.waves))
+    executor = LocalExecutor(
+        directory=client.path,
+        jobs=jobs,
+        run_cache=RunCache(client) if cache else None,
+        usage_log=usage_log,
+    )
+    for step in executor.run(waves):
+        cutoff.completed(step.key)
+        click.echo(
+            '{0}: {1}{2}'.format(
+                step.key[1],
+                ' '.join(step.argv),
+                ' (cached)' if step.cached else '',
+            )
+        )
+
+    if cutoff.skipped:
+        click.echo(
+            'Skipped {0} step(s) with unchanged inputs.'.format(
+                len(cutoff.skipped)
+            )
+        )
+
+
+def _describe_plan(graph, plan, usage_log):
+    """Return ordered steps, waves and estimates of the plan."""
+    G = graph.G
+    steps = []
+    critical_path = {}
+
+    for index, wave in enumerate(plan.waves):
+        for key in wave:
+            step = Step.from_node(key, G.nodes[key]['tool'])
+            estimate = usage_log.estimate(key[1])
+            wall_time = estimate['wall_time'] if estimate else 0.0
+
+            inputs = list(G.predecessors(key))
+            parents = [
+                critical_path[tool] for input_ in inputs
+                for tool in G.predecessors(input_) if tool in critical_path
+            ]
+            critical_path[key] = wall_time + max(parents, default=0.0)
+
+            triggered_by = [
+                input_[1] for input_ in inputs
+                if G.nodes[input_].get('latest') or G.in_degree(input_)
+            ]
+            steps.append({
+                'tool': key[1],
+                'wave': index,
+                'command': step.argv,
+                'triggered_by': sorted(triggered_by),
+                'estimate': estimate,
+            })
+
+    known = [step['estimate'] for step in steps if step['estimate']]
+    return {
+        'steps': steps,
+        'waves': [[key[1] for key in wave] for wave in plan.waves],
+        'estimate': {
+            'wall_time': sum(estimate['wall_time'] for estimate in known),
+            'critical_path': max(critical_path.values(), default=0.0),
+            'unknown': len(steps) - len(known),
+        },
+    }
+
+
+def _echo_plan(description):
+    """Print the execution plan."""
+    for index, wave in enumerate(description['waves']):
+        click.echo('Wave {0}:'.format(index + 1))
+        for step in description['steps']:
+            if step['wave'] != index:
+                continue
+            estimate = step['estimate']
+            click.echo(
+                '\t{0}: {1}'.format(step['tool'], ' '.join(step['command']))
+            )
+            click.echo(
+                '\t\ttriggered by: {0}'.format(
+                    ', '.join(step['triggered_by']) or '-'
+                )
+            )
+            click.echo(
+                '\t\testimate: {0}'.format(
+                    '{0:.2f}s from {1} run(s)'.format(
+                        estimate['wall_time'], estimate['runs']
+                    ) if estimate else 'unknown'
+                )
+            )
+
+    estimate = description['estimate']
+    click.echo(
+        'Estimated time: {0:.2f}s, critical path: {1:.2f}s'.format(
+            estimate['wall_time'], estimate['critical_path']
+        )
+    )
+    if estimate['unknown']:
+        click.echo(
+            '{0} step(s) without recorded executions.'.format(
+                estimate['unknown']
+            )
+        )
@@ -47,9 +47,12 @@ def workflow():
 @pass_local_client
 def create(client, output_file, revision, path):
     """Create a workflow description for a file."""
-    graph = Graph(client)
-    for p in path:
-        graph.add_file(p, revision=revision)
+    graph = Graph(client, use_cache=True)
+    keys = [graph.add_file(p, revision=revision) for p in path]
+    graph.save_cache()
+
+    lineage = graph.lineage(keys)
+    graph.G.remove_nodes_from([n for n in graph.G if n not in lineage])
 
     output_file.write(
         yaml.dump(
@@ -90,5 +90,43 @@ class DirtyRepository(RenkuException, click.ClickException):
         )
 
 
+class ConfigurationError(RenkuException, click.ClickException):
+    """Raise when a configuration value is not valid."""
+
+    def __init__(self, key, value):
+        """Build a custom message."""
+        super(ConfigurationError, self).__init__(
+            'Invalid value "{0}" of configuration option "{1}".'.format(
+                value, key
+            )
+        )
+
+
 class NotFound(APIError):
     """Raise when an API object is not found."""
+
+
+class FailedExecution(RenkuException, click.ClickException):
+    """Raise when a workflow step does not finish successfully."""
+
+    def __init__(self, step, returncode):
+        """Build a custom message."""
+        super(FailedExecution, self).__init__(
+            'Step "{0}" failed with exit code {1}: {2}'.format(
+                step.key[1], returncode, ' '.join(step.argv)
+            )
+        )
+        self.step = step
+        self.returncode = returncode
+
+
+class FailedMerge(RenkuException, click.ClickException):
+    """Raise when a commit can not be merged into the current branch."""
+
+    def __init__(self, commit):
+        """Build a custom message."""
+        super(FailedMerge, self).__init__(
+            'Commit "{0}" could not be merged into the current branch. '
+            'Please merge it with "git merge {0}".'.format(commit.hexsha)
+        )
+        self.commit = commit
@@ -18,9 +18,12 @@
 """Represent a ``CommandLineTool`` from the Common Workflow Language."""
 
 import fnmatch
+import os
 import re
 import shlex
+import subprocess
 from contextlib import contextmanager
+from functools import partial
 
 import attr
 
@@ -33,6 +36,78 @@ from .process import Process
 from .types import File
 
 
+def _snapshot(root, exclude=(), ignored=None):
+    """Return modification and change times, size and inode of files.
+
+    Paths are relative to the root and directories containing a Git
+    repository are skipped like submodules.  Directories of each level are
+    passed together to ``ignored`` and the returned ones are not visited.
+    """
+    snapshot = {}
+    level = ['']
+    while level:
+        directories = []
+        for prefix in level:
+            with os.scandir(os.path.join(root, prefix)) as entries:
+                for entry in entries:
+                    path = prefix + entry.name
+                    if path in exclude:
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if not os.path.exists(
+                            os.path.join(entry.path, '.git')
+                        ):
+                            directories.append(path)
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                    snapshot[path] = (
+                        stat.st_mtime_ns, stat.st_ctime_ns, stat.st_size,
+                        stat.st_ino
+                    )
+
+        if ignored is not None:
+            skipped = ignored(directories)
+            directories = [path for path in directories if path not in skipped]
+        level = [path + '/' for path in directories]
+    return snapshot
+
+
+def _ignored_paths(git, paths):
+    """Return paths matching patterns from ``.gitignore`` files."""
+    if not paths:
+        return set()
+    process = git.git.check_ignore(
+        '-z', '--stdin', as_process=True, istream=subprocess.PIPE
+    )
+    output, _ = process.proc.communicate('\0'.join(paths).encode('utf-8'))
+    return {
+        path
+        for path in output.decode('utf-8', 'surrogateescape').split('\0')
+        if path
+    }
+
+
+def repository_snapshot(repo):
+    """Return a snapshot of files in the working tree of the repository."""
+    exclude = {'.git', str(repo.renku_path.relative_to(repo.path))}
+    return _snapshot(
+        str(repo.path),
+        exclude=exclude,
+        ignored=partial(_ignored_paths, repo.git),
+    )
+
+
+def modified_paths(repo, before, after):
+    """Return sorted paths changed between snapshots and not ignored."""
+    candidates = {
+        path
+        for path in before.keys() | after.keys()
+        if before.get(path) != after.get(path)
+    }
+    candidates -= _ignored_paths(repo.git, candidates)
+    return sorted(candidates)
+
+
 @attr.s
 class CommandLineTool(Process, CWLClass):
     """Represent a command line tool."""
@@ -88,7 +163,7 @@ class CommandLineTool(Process, CWLClass):
         args = [(a.position, a) for a in self.arguments]
         args += [(i.inputBinding.position, i) for i in self.inputs]
 
-        for p, v in sorted(args):
+        for p, v in sorted(args, key=lambda arg: arg[0]):
             argv.extend(v.to_argv())
 
         return argv
@@ -167,42 +242,50 @@ class CommandLineToolFactory(object):
         tool = self.generate_tool()
         git = repo.git
 
+        if git:
+            before = repository_snapshot(repo)
+
         yield tool
 
         if git:
-            candidates = set(git.untracked_files)
-            candidates |= {item.a_path for item in git.index.diff(None)}
+            candidates = modified_paths(
+                repo, before, repository_snapshot(repo)
+            )
+            paths = self.add_outputs(tool, candidates, no_output=no_output)
+            repo.track_paths_in_storage(*paths)
 
-            inputs = {input.id: input for input in self.inputs}
-            outputs = list(tool.outputs)
-            paths = []
+    def add_outputs(self, tool, candidates, no_output=False):
+        """Add outputs detected from modified paths and return their paths."""
+        inputs = {input.id: input for input in self.inputs}
+        outputs = list(tool.outputs)
+        paths = []
 
-            for output, input, path in self.guess_outputs(candidates):
-                outputs.append(output)
-                paths.append(path)
+        for output, input, path in self.guess_outputs(candidates):
+            outputs.append(output)
+            paths.append(path)
 
-                if input is not None:
-                    if input.id not in inputs:  # pragma: no cover
-                        raise RuntimeError('Inconsistent input name.')
+            if input is not None:
+                if input.id not in inputs:  # pragma: no cover
+                    raise RuntimeError('Inconsistent input name.')
 
-                    inputs[input.id] = input
+                inputs[input.id] = input
 
-            if not no_output:
-                for stream_name in ('stdout', 'stderr'):
-                    stream = getattr(self, stream_name)
-                    if stream and stream not in candidates:
-                        raise RuntimeError(
-                            'Output file was not created or changed.'
-                        )
-                    elif stream:
-                        paths.append(stream)
+        if not no_output:
+            for stream_name in ('stdout', 'stderr'):
+                stream = getattr(self, stream_name)
+                if stream and stream not in candidates:
+                    raise RuntimeError(
+                        'Output file was not created or changed.'
+                    )
+                elif stream:
+                    paths.append(stream)
 
-                if not outputs:
-                    raise RuntimeError('No output was detected')
+            if not outputs:
+                raise RuntimeError('No output was detected')
 
-            tool.inputs = list(inputs.values())
-            tool.outputs = outputs
-            repo.track_paths_in_storage(*paths)
+        tool.inputs = list(inputs.values())
+        tool.outputs = outputs
+        return paths
 
     @command_line.validator
     def validate_command_line(self, attribute, value):
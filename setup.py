@@ -112,6 +112,7 @@ setup(
         'console_scripts': ['renku=renku.cli:cli'],
         'renku.cli': [
             # Please keep the items sorted.
+            'cache=renku.cli.cache:cache',
             'dataset=renku.cli.dataset:dataset',
             'deactivate=renku.cli.workon:deactivate',
             'init=renku.cli.init:init',
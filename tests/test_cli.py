@@ -47,6 +47,65 @@ def test_help(arg, base_runner):
     assert 'Show this message and exit.' in result.output
 
 
+def test_lazy_commands(monkeypatch):
+    """Test that stored help lines match the imported commands."""
+    from click.utils import make_default_short_help
+
+    from renku.cli import _group
+
+    group = _group.LazyGroup(lazy_commands=cli.COMMANDS)
+    for name, (_, help) in cli.COMMANDS.items():
+        command = group.get_command(None, name)
+        assert command.name == name
+        assert make_default_short_help(help) == _group.short_help(command)
+
+    assert group.get_command(None, 'unknown') is None
+
+    monkeypatch.setattr(
+        _group, 'iter_entry_points', lambda group: [
+            ('run', 'renku.cli.status:status'),
+            ('broken', 'renku.cli.missing:broken'),
+        ]
+    )
+    group = _group.LazyGroup(
+        lazy_commands=cli.COMMANDS, entry_point_group='renku.cli'
+    )
+    assert group.list_commands(None) == sorted(set(cli.COMMANDS) | {'broken'})
+    assert group.get_command(None, 'run').name == 'run'
+    assert 'Warning' in _group.short_help(group.get_command(None, 'broken'))
+
+
+@pytest.mark.parametrize(
+    'args,expected', (
+        (['--version'], set()),
+        (['help'], set()),
+        (['status', '--help'], {'renku.cli.status', 'networkx'}),
+    )
+)
+def test_startup_imports(args, expected):
+    """Test that only modules of invoked commands are imported."""
+    import subprocess
+
+    code = (
+        'import atexit, sys\n'
+        'atexit.register(lambda: sys.stderr.write("\\n".join(sys.modules)))\n'
+        'from renku.cli import cli\n'
+        'cli()\n'
+    )
+    process = subprocess.run(
+        [sys.executable, '-c', code] + args,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    assert process.returncode == 0
+
+    imported = set(process.stderr.splitlines())
+    heavy = {'networkx', 'pkg_resources'}
+    heavy |= {path.split(':')[0] for path, _ in cli.COMMANDS.values()}
+    assert heavy & imported == expected
+
+
 def test_config_path(instance_path, base_runner):
     """Test config path."""
     result = base_runner.invoke(cli.cli, ['--config-path'])
@@ -100,6 +159,23 @@ def test_init(base_runner):
     assert 'filter "lfs"' in config
 
 
+def test_init_force_existing_files(base_runner):
+    """Test that reinitializing a repository commits existing files."""
+    os.mkdir('existing')
+    with open(os.path.join('existing', 'data.txt'), 'w') as f:
+        f.write('data')
+    git.Repo.init('existing')
+
+    result = base_runner.invoke(
+        cli.cli, ['init', '--force', '--no-external-storage', 'existing']
+    )
+    assert result.exit_code == 0
+
+    repo = git.Repo('existing')
+    assert 'data.txt' in repo.head.commit.tree
+    assert not repo.is_dirty(untracked_files=True)
+
+
 def test_workon(runner):
     """Test switching branches."""
     # Create first issue
@@ -329,3 +405,692 @@ def test_status_with_submodules(base_runner):
 
     result = base_runner.invoke(cli.cli, ['status'], catch_exceptions=False)
     assert result.exit_code != 0
+
+
+def test_status_cache(runner):
+    """Test reuse of the graph snapshot between status calls."""
+    from renku.api import LocalClient
+    from renku.cli._cache import GraphCache
+
+    repo = git.Repo('.')
+
+    with open('source.txt', 'w') as source:
+        source.write('first')
+
+    repo.git.add('--all')
+    repo.index.commit('Added source.txt')
+
+    with open('result.txt', 'w') as stdout:
+        with contextlib.redirect_stdout(stdout):
+            try:
+                cli.cli.main(
+                    args=('run', 'wc', 'source.txt'),
+                    prog_name=runner.get_default_prog_name(cli.cli),
+                )
+            except SystemExit as e:
+                assert e.code in {None, 0}
+
+    result = runner.invoke(cli.cli, ['status'])
+    assert result.exit_code == 0
+    assert os.path.exists('.renku/cache/graph.pickle')
+    assert not repo.is_dirty(untracked_files=True)
+
+    with open('source.txt', 'w') as source:
+        source.write('second')
+
+    repo.git.add('--all')
+    repo.index.commit('Changed source.txt')
+
+    #: The snapshot is extended with the new commit.
+    graph, _ = GraphCache(LocalClient(path='.')).load()
+    latest = {
+        path: data['latest']
+        for (_, path), data in graph.nodes(data=True)
+    }
+    assert latest['source.txt'] == repo.head.commit
+    assert latest['result.txt'] is None
+
+    result = runner.invoke(cli.cli, ['status'])
+    assert result.exit_code == 1
+    assert 'source.txt' in result.output
+
+
+def test_status_cache_lineage(runner):
+    """Test that cached nodes outside the lineage are not reported."""
+    repo = git.Repo('.')
+
+    with open('plain.txt', 'w') as plain:
+        plain.write('first')
+
+    repo.git.add('--all')
+    repo.index.commit('Added plain.txt')
+
+    result = runner.invoke(cli.cli, ['run', 'touch', 'data.csv'])
+    assert result.exit_code == 0
+    result = runner.invoke(cli.cli, ['run', 'cp', 'data.csv', 'copy.csv'])
+    assert result.exit_code == 0
+
+    result = runner.invoke(cli.cli, ['status'])
+    assert result.exit_code == 0
+
+    with open('plain.txt', 'w') as plain:
+        plain.write('second')
+
+    repo.git.add('--all')
+    repo.index.commit('Changed plain.txt')
+
+    result = runner.invoke(cli.cli, ['status'])
+    assert result.exit_code == 0
+    assert 'different versions' not in result.output
+
+    #: Only the lineage of the requested file is rendered.
+    result = runner.invoke(cli.cli, ['log', 'data.csv'])
+    assert result.exit_code == 0
+    assert 'data.csv' in result.output
+    assert 'copy.csv' not in result.output
+    assert 'plain.txt' not in result.output
+
+    result = runner.invoke(cli.cli, ['workflow', 'create', 'data.csv'])
+    assert result.exit_code == 0
+    assert 'touch' in result.output
+    assert 'cp' not in result.output.split()
+
+
+def test_status_paths(runner):
+    """Test status restricted to selected and recently changed files."""
+    repo = git.Repo('.')
+
+    with open('source.txt', 'w') as source:
+        source.write('first')
+
+    repo.git.add('--all')
+    repo.index.commit('Added source.txt')
+
+    result = runner.invoke(cli.cli, ['run', 'cp', 'source.txt', 'copy.txt'])
+    assert result.exit_code == 0
+    result = runner.invoke(cli.cli, ['run', 'cp', 'copy.txt', 'copy2.txt'])
+    assert result.exit_code == 0
+    result = runner.invoke(cli.cli, ['run', 'touch', 'other.txt'])
+    assert result.exit_code == 0
+    since = repo.head.commit.hexsha
+
+    with open('source.txt', 'w') as source:
+        source.write('second')
+
+    repo.git.add('--all')
+    repo.index.commit('Changed source.txt')
+
+    result = runner.invoke(cli.cli, ['status', 'copy.txt'])
+    assert result.exit_code == 1
+    assert 'copy.txt' in result.output
+
+    result = runner.invoke(cli.cli, ['status', 'other.txt'])
+    assert result.exit_code == 0
+
+    #: Outputs generated from the changed input are outdated.
+    result = runner.invoke(cli.cli, ['status', '--changed-since', since])
+    assert result.exit_code == 1
+    assert 'copy.txt' in result.output
+    assert 'copy2.txt' in result.output
+
+    result = runner.invoke(
+        cli.cli, ['status', '--changed-since', since, 'other.txt']
+    )
+    assert result.exit_code == 0
+
+
+def test_update(runner):
+    """Test rerunning outdated steps with the local executor."""
+    repo = git.Repo('.')
+
+    with open('source.txt', 'w') as source:
+        source.write('first')
+
+    repo.git.add('--all')
+    repo.index.commit('Added source.txt')
+
+    result = runner.invoke(cli.cli, ['run', 'cp', 'source.txt', 'copy.txt'])
+    assert result.exit_code == 0
+    result = runner.invoke(cli.cli, ['run', 'cp', 'copy.txt', 'copy2.txt'])
+    assert result.exit_code == 0
+
+    with open('source.txt', 'w') as source:
+        source.write('second')
+
+    repo.git.add('--all')
+    repo.index.commit('Changed source.txt')
+
+    result = runner.invoke(cli.cli, ['update', '--jobs', '2'])
+    assert result.exit_code == 0
+    first = result.output.index('cp source.txt')
+    assert first < result.output.index('cp copy.txt')
+
+    with open('copy2.txt') as f:
+        assert f.read() == 'second'
+
+    result = runner.invoke(cli.cli, ['status'])
+    assert result.exit_code == 0
+
+
+def test_executor_fail_fast(tmpdir):
+    """Test that the first failing step stops the execution."""
+    from renku.cli._executor import LocalExecutor, Step
+    from renku.errors import FailedExecution
+    from renku.models.cwl.command_line_tool import CommandLineTool
+
+    def step(*argv):
+        tool = CommandLineTool(baseCommand=list(argv))
+        return Step.from_node(('sha', argv[0]), tool)
+
+    executor = LocalExecutor(directory=tmpdir.strpath, jobs=2)
+    waves = [[step('true'), step('false')], [step('touch', 'never')]]
+    with pytest.raises(FailedExecution):
+        list(executor.run(waves))
+
+    assert not tmpdir.join('never').exists()
+
+
+def test_run_cache(runner):
+    """Test restoring outputs of a repeated command from the run cache."""
+    repo = git.Repo('.')
+
+    with open('source.txt', 'w') as source:
+        source.write('first\n')
+
+    repo.git.add('--all')
+    repo.index.commit('Added source.txt')
+
+    #: Outputs are recorded only when requested.
+    result = runner.invoke(cli.cli, ['run', 'cp', 'source.txt', 'copy.txt'])
+    assert result.exit_code == 0
+
+    result = runner.invoke(cli.cli, ['cache', 'stats'])
+    assert 'Entries: 0\n' in result.output.split('CWL cache:')[0]
+
+    repo.index.remove(['copy.txt'], working_tree=True)
+    repo.index.commit('Removed copy.txt')
+
+    result = runner.invoke(
+        cli.cli, ['run', '--cache', 'cp', 'source.txt', 'copy.txt']
+    )
+    assert result.exit_code == 0
+    assert 'restored from the cache' not in result.output
+
+    repo.index.remove(['copy.txt'], working_tree=True)
+    repo.index.commit('Removed copy.txt')
+
+    result = runner.invoke(
+        cli.cli, ['run', '--cache', 'cp', 'source.txt', 'copy.txt']
+    )
+    assert result.exit_code == 0
+    assert 'restored from the cache' in result.output
+    assert not repo.is_dirty(untracked_files=True)
+
+    with open('copy.txt') as f:
+        assert f.read() == 'first\n'
+
+    result = runner.invoke(cli.cli, ['cache', 'stats'])
+    assert result.exit_code == 0
+    run_stats = result.output.split('CWL cache:')[0]
+    assert 'Entries: 1\n' in run_stats
+    assert 'Hits: 1\n' in run_stats
+
+    result = runner.invoke(cli.cli, ['cache', 'evict', '--max-entries', '0'])
+    assert result.exit_code == 0
+    assert 'Removed 1 entries.' in result.output
+
+
+def test_run_cache_paths(client):
+    """Test that run cache keys use paths relative to the repository."""
+    from renku.cli.run import _repository_step
+    from renku.models.cwl.command_line_tool import CommandLineToolFactory
+
+    os.mkdir('inputs')
+    with open(os.path.join('inputs', 'source.txt'), 'w') as f:
+        f.write('source')
+
+    os.chdir('inputs')
+    try:
+        factory = CommandLineToolFactory(
+            command_line=['cp', 'source.txt', 'copy.txt']
+        )
+        tool = factory.generate_tool()
+        shutil.copy('source.txt', 'copy.txt')
+        factory.add_outputs(tool, ['copy.txt'])
+
+        step = _repository_step(client, tool)
+    finally:
+        os.chdir('..')
+
+    assert step.inputs == ['inputs/source.txt']
+    assert step.outputs == ['inputs/copy.txt']
+
+
+def test_cwl_cache_stats(runner):
+    """Test that counters of the CWL cache are accumulated on disk."""
+    result = runner.invoke(cli.cli, ['run', 'touch', 'data.csv'])
+    assert result.exit_code == 0
+    result = runner.invoke(cli.cli, ['log', 'data.csv'])
+    assert result.exit_code == 0
+
+    result = runner.invoke(cli.cli, ['cache', 'stats'])
+    assert result.exit_code == 0
+    cwl_stats = result.output.split('CWL cache:')[1]
+    assert 'Entries: 1\n' in cwl_stats
+    assert 'Misses: 1\n' in cwl_stats
+
+
+def test_update_early_cutoff(runner):
+    """Test skipping steps when regenerated inputs did not change."""
+    repo = git.Repo('.')
+
+    with open('source.txt', 'w') as source:
+        source.write('b\na\n')
+
+    repo.git.add('--all')
+    repo.index.commit('Added source.txt')
+
+    result = runner.invoke(
+        cli.cli, ['run', 'sort', '-o', 'sorted.txt', 'source.txt']
+    )
+    assert result.exit_code == 0
+    result = runner.invoke(cli.cli, ['run', 'cp', 'sorted.txt', 'copy.txt'])
+    assert result.exit_code == 0
+
+    with open('source.txt', 'w') as source:
+        source.write('a\nb\n')
+
+    repo.git.add('--all')
+    repo.index.commit('Reordered source.txt')
+
+    result = runner.invoke(cli.cli, ['update', '--no-cache'])
+    assert result.exit_code == 0
+    assert 'sort -o sorted.txt source.txt' in result.output
+    assert 'cp sorted.txt' not in result.output
+    assert 'Skipped 1 step(s)' in result.output
+
+    #: Outputs of the skipped and the unchanged steps are up-to-date.
+    result = runner.invoke(cli.cli, ['status'])
+    assert result.exit_code == 0
+
+    result = runner.invoke(cli.cli, ['update', '--no-cache'])
+    assert result.exit_code == 0
+    assert 'sort -o sorted.txt source.txt' not in result.output
+
+
+def test_status_reverted_input(runner):
+    """Test that reverted input content does not make outputs outdated."""
+    repo = git.Repo('.')
+
+    with open('source.txt', 'w') as source:
+        source.write('first')
+
+    repo.git.add('--all')
+    repo.index.commit('Added source.txt')
+
+    result = runner.invoke(cli.cli, ['run', 'cp', 'source.txt', 'copy.txt'])
+    assert result.exit_code == 0
+
+    for content in ('second', 'first'):
+        with open('source.txt', 'w') as source:
+            source.write(content)
+
+        repo.git.add('--all')
+        repo.index.commit('Changed source.txt')
+
+        result = runner.invoke(cli.cli, ['status'])
+        assert result.exit_code == (1 if content == 'second' else 0)
+
+    #: Versions are compared with the requested revision.
+    result = runner.invoke(cli.cli, ['status', '--revision', 'HEAD~1'])
+    assert result.exit_code == 1
+    assert 'copy.txt' in result.output
+
+    result = runner.invoke(cli.cli, ['status'])
+    assert result.exit_code == 0
+
+
+def test_update_dry_run(runner):
+    """Test printing the execution plan with recorded estimates."""
+    import json
+
+    repo = git.Repo('.')
+
+    def change_source(content):
+        with open('source.txt', 'w') as source:
+            source.write(content)
+        repo.git.add('--all')
+        repo.index.commit('Changed source.txt')
+
+    change_source('first')
+    result = runner.invoke(cli.cli, ['run', 'cp', 'source.txt', 'copy.txt'])
+    assert result.exit_code == 0
+    result = runner.invoke(cli.cli, ['run', 'cp', 'copy.txt', 'copy2.txt'])
+    assert result.exit_code == 0
+
+    change_source('second')
+    head = repo.head.commit
+    result = runner.invoke(cli.cli, ['update', '--json'])
+    assert result.exit_code == 0
+    assert repo.head.commit == head
+
+    plan = json.loads(result.output)
+    assert [step['command'] for step in plan['steps']] == [
+        ['cp', 'source.txt', 'copy.txt'],
+        ['cp', 'copy.txt', 'copy2.txt'],
+    ]
+    assert [step['triggered_by'] for step in plan['steps']] == [
+        ['source.txt'],
+        ['copy.txt'],
+    ]
+    assert len(plan['waves']) == 2
+    assert [step['estimate']['runs'] for step in plan['steps']] == [1, 1]
+    assert plan['estimate']['unknown'] == 0
+
+    result = runner.invoke(cli.cli, ['update', '--no-cache'])
+    assert result.exit_code == 0
+
+    change_source('third')
+    result = runner.invoke(cli.cli, ['update', '--dry-run'])
+    assert result.exit_code == 0
+    assert 'from 2 run(s)' in result.output
+
+
+def test_run_usage(runner, client):
+    """Test recording of resources used by a tracked command."""
+    import json
+
+    result = runner.invoke(
+        cli.cli, ['run', 'sh', '-c', 'echo data > output.txt; exit 0']
+    )
+    assert result.exit_code == 0
+
+    repo = git.Repo('.')
+    usage_paths = [
+        path for path in repo.head.commit.stats.files
+        if path.endswith('.usage.json')
+    ]
+    assert len(usage_paths) == 1
+    assert usage_paths[0].startswith('.renku/workflow/')
+
+    with open(usage_paths[0]) as fp:
+        records = json.load(fp)
+    assert len(records) == 1
+    assert records[0]['exit_code'] == 0
+    assert records[0]['wall_time'] > 0
+    assert records[0]['max_rss'] > 0
+    for name in ('user_time', 'system_time', 'read_bytes', 'written_bytes'):
+        assert records[0][name] >= 0
+
+
+def test_run_ignored_outputs(runner, client):
+    """Test that files matching ignore patterns are not outputs."""
+    repo = git.Repo('.')
+    with open('.gitignore', 'a') as gitignore:
+        gitignore.write('\n*.log\nbuild/\n')
+    repo.git.add('--all')
+    repo.index.commit('Ignore logs')
+
+    result = runner.invoke(
+        cli.cli, [
+            'run', 'sh', '-c', 'echo a > output.txt; echo b > run.log; '
+            'mkdir build; echo c > build/output.txt'
+        ]
+    )
+    assert result.exit_code == 0
+
+    #: Ignored directories are not visited.
+    from renku.models.cwl.command_line_tool import repository_snapshot
+    assert 'run.log' in repository_snapshot(client)
+    assert not any(
+        path.startswith('build/') for path in repository_snapshot(client)
+    )
+
+    cwl = next(client.workflow_path.glob('*.cwl'))
+    with cwl.open() as fp:
+        outputs = yaml.load(fp)['outputs']
+    globs = [output['outputBinding']['glob'] for output in outputs.values()]
+    assert globs == ['output.txt']
+
+
+def test_run_stages_paths(runner, client):
+    """Test that only paths modified by the command are committed."""
+    repo = git.Repo('.')
+    result = runner.invoke(cli.cli, ['run', 'touch', 'output.txt'])
+    assert result.exit_code == 0
+
+    paths = set(repo.head.commit.stats.files) - {'.gitattributes'}
+    assert 'output.txt' in paths
+    assert {os.path.splitext(path)[1]
+            for path in paths} == {'.txt', '.cwl', '.json'}
+    assert len(paths) == 3
+    assert not repo.is_dirty()
+
+
+def test_stage_removed_paths(client):
+    """Test that removed registered paths are staged as deletions."""
+    import click
+
+    from renku.cli._git import _stage, stage_paths
+
+    repo = client.git
+    with open('removed.txt', 'w') as f:
+        f.write('removed')
+    repo.git.add('removed.txt')
+    repo.index.commit('Added removed.txt')
+
+    os.remove('removed.txt')
+    with click.Context(click.Command('test')).scope():
+        stage_paths('removed.txt', 'missing.txt')
+        assert _stage(repo)
+    assert 'removed.txt' not in repo.git.ls_files().splitlines()
+
+    repo.index.commit('Removed removed.txt')
+    with click.Context(click.Command('test')).scope():
+        stage_paths('missing.txt')
+        assert not _stage(repo)
+
+
+def test_mapped_std_streams(client, monkeypatch):
+    """Test lookup of standard streams redirected to repository files."""
+    from renku.cli._git import _index_stat_map, _mapped_std_streams
+
+    repo = client.git
+    with open('tracked.txt', 'w') as f:
+        f.write('tracked')
+    repo.git.add('tracked.txt')
+    repo.index.commit('Added tracked.txt')
+    assert 'tracked.txt' in _index_stat_map(repo).values()
+
+    with open('tracked.txt', 'r') as stdin, open('untracked.txt', 'w') as out:
+        monkeypatch.setattr(sys, 'stdin', stdin)
+        monkeypatch.setattr(sys, 'stdout', out)
+        assert _mapped_std_streams(repo) == {
+            'stdin': 'tracked.txt',
+            'stdout': 'untracked.txt',
+        }
+
+    #: Files outside of the repository do not need a scan.
+    monkeypatch.setattr(
+        git.Repo, 'untracked_files',
+        property(lambda self: pytest.fail('Untracked files were scanned.'))
+    )
+    outside = client.path.parent / 'outside.txt'
+    outside.write_text('outside')
+    with outside.open() as stdin:
+        monkeypatch.setattr(sys, 'stdin', stdin)
+        assert _mapped_std_streams(repo) == {}
+
+
+def test_run_isolation(runner, client):
+    """Test concurrent commands executed in isolated worktrees."""
+    import subprocess
+
+    repo = git.Repo('.')
+    head = repo.head.commit
+    processes = [
+        subprocess.Popen([
+            sys.executable, '-c', 'from renku.cli import cli; cli()', 'run',
+            '--isolation', 'sh', '-c',
+            'sleep 1; echo {0} > output{0}.txt'.format(index)
+        ]) for index in range(3)
+    ]
+    assert [process.wait() for process in processes] == [0, 0, 0]
+
+    for index in range(3):
+        with open('output{0}.txt'.format(index)) as f:
+            assert f.read() == '{0}\n'.format(index)
+
+    assert not repo.is_dirty(untracked_files=True)
+    assert repo.is_ancestor(head, repo.head.commit)
+    assert len(list(client.workflow_path.glob('*.cwl'))) == 3
+    assert not list((client.cache_path / 'worktrees').glob('tmp*'))
+
+    result = runner.invoke(cli.cli, ['status'])
+    assert result.exit_code == 0
+    assert 'outdated' not in result.output
+
+    result = runner.invoke(
+        cli.cli, ['run', '--isolation', '--cache', 'touch', 'output.txt']
+    )
+    assert result.exit_code == 2
+    assert not os.path.exists('output.txt')
+
+
+def test_run_isolation_external_storage(client):
+    """Test concurrent isolated commands tracking outputs in storage."""
+    import subprocess
+
+    repo = git.Repo('.')
+    with repo.config_writer() as config:
+        config.set_value('filter "lfs"', 'clean', 'cat')
+        config.set_value('filter "lfs"', 'smudge', 'cat')
+
+    code = (
+        'from renku.api import repository\n'
+        'repository.has_lfs = lambda: True\n'
+        'from renku.cli import cli\n'
+        'cli()\n'
+    )
+    processes = [
+        subprocess.Popen([
+            sys.executable, '-c', code, 'run', '--isolation', 'sh', '-c',
+            'sleep 1; echo {0} > output{0}.txt'.format(index)
+        ]) for index in range(3)
+    ]
+    assert [process.wait() for process in processes] == [0, 0, 0]
+
+    with open('.gitattributes') as f:
+        attributes = f.read()
+    for index in range(3):
+        assert 'output{0}.txt filter=lfs'.format(index) in attributes
+    assert not repo.is_dirty(untracked_files=True)
+
+
+def test_concurrent_worktrees(client):
+    """Test creating cache folders and worktrees at the same time."""
+    import shutil
+    from concurrent.futures import ThreadPoolExecutor
+
+    from renku.api import LocalClient
+    from renku.cli._git import with_worktree
+
+    shutil.rmtree(str(client.cache_path))
+
+    def checkout(_):
+        cache_path = LocalClient(path=client.path).cache_path
+        with with_worktree(client.git, cache_path / 'worktrees') as repo:
+            return repo.head.commit
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        commits = list(executor.map(checkout, range(8)))
+
+    assert commits == [client.git.head.commit] * 8
+    assert (client.cache_path / '.gitignore').read_text() == '*\n'
+    assert not client.git.is_dirty(untracked_files=True)
+
+
+def test_cache_clear_worktrees(runner, client):
+    """Test that clearing caches keeps worktrees of running commands."""
+    from renku.cli._git import with_worktree
+
+    stale = client.cache_path / 'stale'
+    client.git.git.worktree('add', '--detach', str(stale))
+    (client.cache_path / 'cwl').mkdir()
+
+    with with_worktree(client.git, client.cache_path / 'worktrees') as repo:
+        result = runner.invoke(cli.cli, ['cache', 'clear'])
+        assert result.exit_code == 0
+        assert os.path.exists(repo.working_tree_dir)
+        assert len(client.git.git.worktree('list').splitlines()) == 2
+
+    assert not stale.exists()
+    assert not (client.cache_path / 'cwl').exists()
+    assert len(client.git.git.worktree('list').splitlines()) == 1
+
+
+@pytest.mark.parametrize('jobs', ['1', '3'])
+def test_run_manifest(runner, client, jobs):
+    """Test recording commands from a manifest in one commit."""
+    repo = git.Repo('.')
+    head = repo.head.commit
+    manifest = client.path.parent / 'manifest.txt'
+    manifest.write_text(
+        '# parameter sweep\n\n' + ''.join(
+            'sh -c "echo {0} > $0" output{0}.txt\n'.format(index)
+            for index in range(3)
+        )
+    )
+
+    result = runner.invoke(
+        cli.cli, ['run', '--manifest',
+                  str(manifest), '--jobs', jobs]
+    )
+    assert result.exit_code == 0
+    assert repo.head.commit.parents == (head, )
+    assert not repo.is_dirty(untracked_files=True)
+    assert len(list(client.workflow_path.glob('*.cwl'))) == 3
+
+    for index in range(3):
+        with open('output{0}.txt'.format(index)) as f:
+            assert f.read() == '{0}\n'.format(index)
+
+    result = runner.invoke(cli.cli, ['status'])
+    assert result.exit_code == 0
+    assert 'outdated' not in result.output
+
+
+def test_run_manifest_chained(runner, client):
+    """Test that outputs of previous commands are inputs of later ones."""
+    repo = git.Repo('.')
+    with open('a.txt', 'w') as f:
+        f.write('first')
+    repo.git.add('--all')
+    repo.index.commit('Added a.txt')
+
+    manifest = client.path.parent / 'manifest.txt'
+    manifest.write_text('cp a.txt b.txt\ncp b.txt c.txt\n')
+    result = runner.invoke(cli.cli, ['run', '--manifest', str(manifest)])
+    assert result.exit_code == 0
+
+    with open('a.txt', 'w') as f:
+        f.write('second')
+    repo.git.add('--all')
+    repo.index.commit('Changed a.txt')
+
+    result = runner.invoke(cli.cli, ['status'])
+    assert result.exit_code == 1
+    assert 'c.txt' in result.output
+
+
+def test_run_manifest_ambiguous(runner, client):
+    """Test that concurrent commands must name their outputs."""
+    manifest = client.path.parent / 'manifest.txt'
+    manifest.write_text('touch first.txt\nsh -c "touch second.txt"\n')
+
+    result = runner.invoke(
+        cli.cli, ['run', '--manifest',
+                  str(manifest), '--jobs', '2']
+    )
+    assert result.exit_code != 0
+    assert 'second.txt' in result.output
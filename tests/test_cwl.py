@@ -214,3 +214,16 @@ def test_09_array_inputs(instance_path):
     assert tool.inputs[-1].inputBinding.separate is False
 
     assert tool.to_argv() == argv
+
+
+def test_argv_equal_positions(instance_path):
+    """Test that arguments and inputs may share a position."""
+    (Path(instance_path) / 'input.txt').touch()
+
+    factory = CommandLineToolFactory(
+        ['wc', '-c'],
+        directory=instance_path,
+        stdin='input.txt',
+    )
+    tool = factory.generate_tool()
+    assert tool.to_argv()[:2] == ['wc', '-c']
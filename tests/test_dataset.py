@@ -165,3 +165,66 @@ def test_author_parse(authors, data_file):
     # authors must be a set or list of dicts or Author
     with pytest.raises(ValueError):
         f = DatasetFile('file', authors=['name'])
+
+
+def test_track_paths_in_storage(client, monkeypatch):
+    """Test batched tracking of large files in external storage."""
+    from renku.api import repository
+
+    monkeypatch.setattr(repository, 'has_lfs', lambda: True)
+    with client.git.config_writer() as config:
+        config.set_value('filter "lfs"', 'required', 'true')
+        config.set_value('renku', client.LFS_THRESHOLD, 10)
+
+    (client.path / 'small.txt').write_text('x')
+    (client.path / 'large file.txt').write_text('x' * 100)
+    attributes = client.path / '.gitattributes'
+    before = attributes.read_text() if attributes.exists() else ''
+
+    client.track_paths_in_storage('small.txt', 'large file.txt', 'missing')
+    client.track_paths_in_storage(client.path / 'large file.txt')
+
+    assert attributes.read_text()[len(before):] == (
+        'large[[:space:]]file.txt filter=lfs diff=lfs merge=lfs -text\n'
+    )
+
+
+@pytest.mark.parametrize(
+    'value,expected', [
+        ('10', 10),
+        ('10k', 10 * 1024),
+        ('10M', 10 * 1024**2),
+        ('1g', 1024**3),
+    ]
+)
+def test_lfs_threshold(client, value, expected):
+    """Test parsing of Git sizes in the threshold of external storage."""
+    with client.git.config_writer() as config:
+        config.set_value('renku', client.LFS_THRESHOLD, value)
+    assert client.lfs_threshold == expected
+
+
+def test_lfs_threshold_invalid(client):
+    """Test that an invalid threshold of external storage is reported."""
+    from renku import errors
+
+    with client.git.config_writer() as config:
+        config.set_value('renku', client.LFS_THRESHOLD, '10 MB')
+    with pytest.raises(errors.ConfigurationError):
+        client.lfs_threshold
+
+
+def test_import_without_subprocess():
+    """Test that importing the API does not start any process."""
+    import subprocess
+    import sys
+
+    #: GitPython checks the Git version on import.
+    code = (
+        'import git, subprocess\n'
+        'def fail(*args, **kwargs):\n'
+        '    raise AssertionError(args)\n'
+        'subprocess.Popen.__init__ = fail\n'
+        'import renku.api\n'
+    )
+    assert subprocess.call([sys.executable, '-c', code]) == 0
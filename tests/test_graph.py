@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2018 - Swiss Data Science Center (SDSC)
+# A partnership between École Polytechnique Fédérale de Lausanne (EPFL) and
+# Eidgenössische Technische Hochschule Zürich (ETHZ).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Provenance graph tests."""
+
+import git
+import pytest
+
+from renku.cli._history import HistoryIndex
+
+
+@pytest.fixture()
+def history_repository(tmpdir):
+    """Create a repository with a merged branch."""
+    repo = git.Repo.init(tmpdir.strpath)
+    actor = git.Actor('me', 'me@example.com')
+
+    def commit(name, content):
+        tmpdir.join(name).write(content)
+        repo.index.add([tmpdir.join(name).strpath])
+        return repo.index.commit(name, author=actor, committer=actor)
+
+    commit('a', '1')
+    commit('b', '1')
+    master = repo.head.reference
+    branch = repo.create_head('branch')
+    branch.checkout()
+    commit('a', '2')
+    master.checkout()
+    commit('b', '2')
+    merge_base = repo.merge_base(master, branch)
+    repo.index.merge_tree(branch, base=merge_base)
+    repo.index.commit(
+        'merge',
+        parent_commits=(master.commit, branch.commit),
+        author=actor,
+        committer=actor,
+    )
+    repo.index.checkout(force=True)
+    commit('a', '3')
+    return repo
+
+
+@pytest.fixture()
+def merged_history_repository(history_repository):
+    """Add merges keeping a version of one parent or resolving a conflict."""
+    repo = history_repository
+    actor = git.Actor('me', 'me@example.com')
+    master = repo.heads.master
+    branch = repo.heads.branch
+
+    def commit(name, content, parents=None):
+        path = repo.working_tree_dir + '/' + name
+        with open(path, 'w') as f:
+            f.write(content)
+        repo.index.add([path])
+        return repo.index.commit(
+            name,
+            parent_commits=parents,
+            author=actor,
+            committer=actor,
+        )
+
+    branch.checkout(force=True)
+    commit('b', '3')
+    master.checkout(force=True)
+    commit('b', '4')
+    #: The merge keeps the version from the second parent.
+    commit('b', '3', parents=(master.commit, branch.commit))
+
+    branch.checkout(force=True)
+    commit('a', '4')
+    master.checkout(force=True)
+    commit('a', '5')
+    #: The merge resolves a conflict with a new version.
+    commit('a', '6', parents=(master.commit, branch.commit))
+    return repo
+
+
+def test_history_index(history_repository):
+    """Test lookups in the history index against Git."""
+    repo = history_repository
+    index = HistoryIndex(repo)
+    assert index.update() == {'a', 'b'}
+    assert not index.linear
+
+    for commit in repo.iter_commits():
+        for path in ('a', 'b'):
+            expected = next(repo.iter_commits(commit, paths=path), None)
+            assert index.last_commit(path, commit.hexsha) == expected
+
+            later = list(repo.iter_commits('{0}..'.format(commit), paths=path))
+            expected = later[-1] if later else None
+            assert index.next_commit(path, commit) == expected
+
+    assert index.update() == set()
+
+    #: Only new commits are indexed.
+    path = repo.working_tree_dir + '/b'
+    with open(path, 'w') as f:
+        f.write('3')
+    repo.index.add([path])
+    commit = repo.index.commit('b')
+    assert index.update() == {'b'}
+    assert index.last_commit('b') == commit
+
+
+def test_history_index_merges(merged_history_repository):
+    """Test lookups through merges compared with each parent."""
+    repo = merged_history_repository
+    index = HistoryIndex(repo)
+    assert index.update() == {'a', 'b'}
+
+    for commit in repo.iter_commits():
+        for path in ('a', 'b'):
+            expected = next(repo.iter_commits(commit, paths=path), None)
+            assert index.last_commit(path, commit.hexsha) == expected
+
+    head = repo.head.commit
+    assert index.last_commit('a') == head
+    assert index.newer_commit('a', head) is None
+    assert index.newer_commit('a', head.parents[1]) is not None
+    assert index.last_commit('b') == repo.commit('HEAD~2^2')
+    assert index.newer_commit('b', repo.commit('HEAD~2^2')) is None
+
+
+def test_commit_paths(history_repository):
+    """Test memoized lookup of paths modified by a commit."""
+    from renku.cli._git import _commit_paths
+
+    repo = history_repository
+    root = list(repo.iter_commits())[-1]
+
+    assert _commit_paths(root) == {'a'}
+    assert _commit_paths(root, prefix='b') == set()
+    assert _commit_paths(repo.head.commit) == {'a'}
+    assert _commit_paths(repo.head.commit) is _commit_paths(repo.head.commit)
+
+
+def test_cwl_cache(runner, client):
+    """Test that each CWL blob is parsed only once."""
+    from renku import cli
+    from renku.cli._cache import CWLCache
+    from renku.cli._graph import Graph
+
+    result = runner.invoke(cli.cli, ['run', 'touch', 'data.csv'])
+    assert result.exit_code == 0
+
+    cwl_cache = CWLCache(path=client.cache_path / 'cwl')
+    graph = Graph(client, cwl_cache=cwl_cache)
+    graph.add_file('data.csv')
+    #: The tool is loaded first for the map of workflow outputs.
+    assert cwl_cache.stats() == {'hits': 1, 'disk_hits': 0, 'misses': 1}
+
+    commit, path = next(key for key in graph.G if key[1] != 'data.csv')
+    tool = graph.load_cwl(graph.find_commit(path), path)
+    assert tool is graph.G.nodes[commit, path]['tool']
+    #: Nodes reference tools lazily through the cache.
+    assert cwl_cache.hits == 3
+
+    cwl_cache = CWLCache(path=client.cache_path / 'cwl')
+    Graph(client, cwl_cache=cwl_cache).add_file('data.csv')
+    assert cwl_cache.stats() == {'hits': 1, 'disk_hits': 1, 'misses': 0}
+
+
+def test_need_update_bitsets(client):
+    """Test propagation of outdated sources through a deep chain."""
+    import networkx as nx
+
+    from renku.cli._graph import Graph
+
+    graph = Graph(client)
+    depth = 2000
+    nx.add_path(graph.G, range(depth))
+    nx.set_node_attributes(graph.G, None, 'latest')
+    graph.G.nodes[0]['latest'] = 'newer'
+    graph.G.nodes[10]['latest'] = 'newer'
+    graph._need_update()
+
+    assert not graph.is_outdated(0)
+    assert graph.is_outdated(5)
+    assert graph.outdated_sources(5) == [0]
+    assert graph.outdated_sources(depth - 1) == [0, 10]
+    #: Nodes without new sources share the same bitset.
+    assert graph._outdated[depth - 1] is graph._outdated[11]
+
+
+def test_parallel_build_status(runner, client):
+    """Test that a graph built by worker processes equals the serial one."""
+    from renku import cli
+    from renku.cli._graph import Graph
+
+    for index in range(4):
+        result = runner.invoke(
+            cli.cli, ['run', 'touch', 'output{0}.txt'.format(index)]
+        )
+        assert result.exit_code == 0
+        result = runner.invoke(
+            cli.cli, [
+                'run', 'cp', 'output{0}.txt'.format(index),
+                'copy{0}.txt'.format(index)
+            ]
+        )
+        assert result.exit_code == 0
+
+    serial = Graph(client)
+    expected = serial.build_status()
+    parallel = Graph(client)
+    assert parallel.build_status(jobs=2) == expected
+
+    assert list(parallel.G.nodes(data=True)) == list(serial.G.nodes(data=True))
+    assert sorted(parallel.G.edges(data=True)) == sorted(
+        serial.G.edges(data=True)
+    )
+    assert parallel.G.graph == serial.G.graph
+
+
+def test_contract_in_place(client):
+    """Test in place contraction against networkx."""
+    import networkx as nx
+
+    from renku.cli._graph import Graph
+
+    graph = Graph(client)
+    nx.add_path(graph.G, ['a', 'b', 'c'], id='edge')
+    nx.add_path(graph.G, ['d', 'e'])
+    expected = nx.contracted_nodes(graph.G, 'e', 'b')
+
+    graph._contract('e', 'b')
+    assert list(graph.G.nodes(data=True)) == list(expected.nodes(data=True))
+    assert sorted(graph.G.edges(data=True)) == sorted(
+        expected.edges(data=True)
+    )
+
+
+def test_node_data():
+    """Test mapping interface of slotted node attributes."""
+    import pickle
+
+    from renku.cli._graph import NodeData, ProvenanceGraph
+
+    data = NodeData(path='a', latest=None, custom=1)
+    assert not hasattr(data, '__dict__')
+    assert dict(data) == {'path': 'a', 'latest': None, 'custom': 1}
+    assert data.get('tool') is None
+    assert 'latest' in data and 'tool' not in data
+
+    del data['custom']
+    data.setdefault('contraction', {})['b'] = NodeData(path='b')
+    assert pickle.loads(pickle.dumps(data)) == data
+
+    G = ProvenanceGraph()
+    G.add_node('a', **data)
+    assert isinstance(G.nodes['a'], NodeData)
+    assert G.copy().nodes['a'] == data
+
+
+def test_lazy_tools(runner, client):
+    """Test that tools in a graph snapshot are loaded on first access."""
+    from renku import cli
+    from renku.cli._cache import CWLCache, GraphCache, ToolHandle
+
+    result = runner.invoke(cli.cli, ['run', 'touch', 'data.csv'])
+    assert result.exit_code == 0
+    result = runner.invoke(cli.cli, ['status'])
+    assert result.exit_code == 0
+
+    cwl_cache = CWLCache()
+    graph, _ = GraphCache(client).load(cwl_cache=cwl_cache)
+    key = next(key for key in graph if key[1] != 'data.csv')
+    assert isinstance(graph.nodes[key].tool, ToolHandle)
+    assert cwl_cache.stats()['misses'] == 0
+
+    assert graph.nodes[key]['tool'].baseCommand == ['touch']
+    assert cwl_cache.stats()['misses'] == 1
+
+
+def test_execution_plan(client):
+    """Test subgraph selection against ancestor queries."""
+    import random
+
+    import networkx as nx
+
+    from renku.cli._graph import Graph
+
+    graph = Graph(client)
+    graph.G.add_edges_from(
+        nx.gnp_random_graph(60, 0.08, seed=1, directed=True).edges()
+    )
+    graph.G.remove_edges_from([(u, v)
+                               for u, v in list(graph.G.edges()) if u > v])
+    for key in graph.G:
+        if key % 2:
+            graph.G.nodes[key]['tool'] = None
+
+    rng = random.Random(1)
+    outputs = set(rng.sample(list(graph.G), 10))
+    clean = set(rng.sample(list(graph.G), 5))
+
+    expected = set()
+    for key in outputs:
+        expected |= nx.ancestors(graph.G, key) | {key}
+    for key in clean:
+        expected -= nx.ancestors(graph.G, key)
+
+    plan = graph.execution_plan(outputs, clean=clean)
+    assert plan.nodes == expected
+    assert sorted(plan.tools) == sorted(k for k in expected if k % 2)
+
+    #: Each tool runs after all selected tools it depends on.
+    wave_of = {
+        key: index
+        for index, wave in enumerate(plan.waves) for key in wave
+    }
+    for key in plan.tools:
+        for parent in nx.ancestors(graph.G.subgraph(expected), key):
+            if parent in wave_of:
+                assert wave_of[parent] < wave_of[key]
+
+
+def test_history_index_segments(history_repository):
+    """Test that lookups in a merged history visit only segments."""
+    repo = history_repository
+    actor = git.Actor('me', 'me@example.com')
+    filepath = repo.working_tree_dir + '/b'
+    for index in range(50):
+        with open(filepath, 'w') as f:
+            f.write(str(index))
+        repo.index.add([filepath])
+        repo.index.commit(str(index), author=actor, committer=actor)
+
+    index = HistoryIndex(repo)
+    index.update()
+    assert not index.linear
+    assert len(set(index.segments)) < 10
+
+    class CountingList(list):
+        reads = 0
+
+        def __getitem__(self, key):
+            CountingList.reads += 1
+            return super(CountingList, self).__getitem__(key)
+
+    index.parents = CountingList(index.parents)
+    for commit in list(repo.iter_commits())[1:]:
+        for path in ('a', 'b'):
+            expected = next(repo.iter_commits(commit, paths=path), None)
+            assert index.last_commit(path, commit.hexsha) == expected
+
+            later = list(repo.iter_commits('{0}..'.format(commit), paths=path))
+            expected = later[-1] if later else None
+            assert index.next_commit(path, commit) == expected
+
+    #: Ancestors are resolved once per segment and not per lookup.
+    assert CountingList.reads < 10
+
+
+def test_settled_outputs_snapshot(runner, client):
+    """Test that only new workflow commits are loaded for settled outputs."""
+    from renku import cli
+    from renku.cli._cache import CWLCache
+    from renku.cli._graph import Graph
+
+    def update_source(content):
+        with open('source.txt', 'w') as source:
+            source.write(content)
+        client.git.git.add('--all')
+        client.git.index.commit('Changed source.txt')
+
+    update_source('first')
+    result = runner.invoke(cli.cli, ['run', 'cp', 'source.txt', 'copy.txt'])
+    assert result.exit_code == 0
+    update_source('second')
+    result = runner.invoke(cli.cli, ['update'])
+    assert result.exit_code == 0
+    result = runner.invoke(cli.cli, ['status'])
+    assert result.exit_code == 0
+
+    cwl_cache = CWLCache()
+    graph = Graph(client, use_cache=True, cwl_cache=cwl_cache)
+    assert list(graph.settled_outputs()) == ['copy.txt']
+    assert cwl_cache.stats() == {'hits': 0, 'disk_hits': 0, 'misses': 0}
+
+    update_source('third')
+    result = runner.invoke(cli.cli, ['update'])
+    assert result.exit_code == 0
+
+    graph = Graph(client, use_cache=True, cwl_cache=cwl_cache)
+    assert len(graph.settled_outputs()['copy.txt']) == 2
+    #: Only the new workflow and its step are loaded.
+    assert cwl_cache.stats()['misses'] == 2